@@ -29,5 +29,36 @@ DEFAULT_PANO_ZERO_OFFSET = 0.0 # This will be updated by offset_analyzer if run
 DEFAULT_FACES_TO_SAVE = ["front"]
 ALL_POSSIBLE_CUBE_FACES = ["front", "right", "back", "left", "top", "bottom"]
 
+# Blurring: Gaussian kernel size in pixels. Must be odd (OpenCV requirement).
+DEFAULT_BLUR_KERNEL_SIZE = 31
+
 # --- CUDA DEVICE ---
-DEVICE = "cuda" # if torch.cuda.is_available() is True else 'cpu' # "cuda" or "cpu"
\ No newline at end of file
+DEVICE = "cuda" # if torch.cuda.is_available() is True else 'cpu' # "cuda" or "cpu"
+
+
+def validate_config_values():
+    """
+    Sanity-checks the configuration values above and returns a list of error
+    strings (empty when everything is valid). Orchestrators call this before
+    running any stage so a bad value (e.g. an even blur kernel, which crashes
+    OpenCV) fails immediately instead of minutes into the pipeline.
+    """
+    errors = []
+    if DEFAULT_SAMPLING_DISTANCE_M <= 0:
+        errors.append(f"DEFAULT_SAMPLING_DISTANCE_M must be positive, got {DEFAULT_SAMPLING_DISTANCE_M}")
+    if DEFAULT_MAX_FACADE_DIST_M <= 0:
+        errors.append(f"DEFAULT_MAX_FACADE_DIST_M must be positive, got {DEFAULT_MAX_FACADE_DIST_M}")
+    if not 0 < DEFAULT_FRONTAL_TOL_DEG <= 180:
+        errors.append(f"DEFAULT_FRONTAL_TOL_DEG must be in (0, 180], got {DEFAULT_FRONTAL_TOL_DEG}")
+    if DEFAULT_ROTATION_DIST_CUTOFF_M <= 0:
+        errors.append(f"DEFAULT_ROTATION_DIST_CUTOFF_M must be positive, got {DEFAULT_ROTATION_DIST_CUTOFF_M}")
+    unknown_faces = set(DEFAULT_FACES_TO_SAVE) - set(ALL_POSSIBLE_CUBE_FACES)
+    if unknown_faces:
+        errors.append(f"DEFAULT_FACES_TO_SAVE contains unknown faces {sorted(unknown_faces)}; valid: {ALL_POSSIBLE_CUBE_FACES}")
+    if DEFAULT_BLUR_KERNEL_SIZE <= 0 or DEFAULT_BLUR_KERNEL_SIZE % 2 == 0:
+        errors.append(f"DEFAULT_BLUR_KERNEL_SIZE must be a positive odd integer, got {DEFAULT_BLUR_KERNEL_SIZE}")
+    if not (DEVICE == "cpu" or DEVICE.startswith("cuda")):
+        errors.append(f"DEVICE must be 'cpu' or 'cuda[:N]', got '{DEVICE}'")
+    elif DEVICE.startswith("cuda") and not torch.cuda.is_available():
+        errors.append("DEVICE is set to 'cuda' but torch reports no CUDA device available")
+    return errors
\ No newline at end of file
@@ -34,12 +34,28 @@ import os
 import sys
 import json
 import shutil
+import numpy as np
 import geopandas as gpd
 from shapely.geometry import Point
 import pandas as pd
 from pathlib import Path
 from tqdm import tqdm
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+# ijson lets the metadata filter stream records instead of materializing the
+# whole description JSON; fall back to stdlib json if it is not installed.
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# orjson speeds up the non-streaming JSON encode/decode paths several-fold on
+# dict-heavy payloads; optional like ijson.
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Assuming 'config.py' and 'utils.py' are in a location findable by Python,
 # e.g., in the same directory as this script or in a 'scripts' subdirectory
@@ -49,7 +65,10 @@ import config
 from utils import (
     ensure_dir_exists,
     find_closest_building_by_latlon,
-    calculate_distance_meters
+    get_transformer,
+    safe_dirname,
+    load_footprints_cached,
+    has_file_with_suffix
 )
 import sample
 import privacy_blur
@@ -60,6 +79,55 @@ import extract_cube
 import sort
 
 
+def _iter_pano_records(json_path: str):
+    """
+    Yields panorama records from a mapillary_image_description.json one at a
+    time. With ijson installed the file is parsed incrementally, keeping peak
+    memory flat regardless of how many frames were sampled from the video.
+    """
+    if ijson is not None:
+        with open(json_path, 'rb') as f:
+            yield from ijson.items(f, 'item')
+    elif orjson is not None:
+        with open(json_path, 'rb') as f:
+            yield from orjson.loads(f.read())
+    else:
+        with open(json_path, 'r', encoding='utf-8') as f:
+            yield from json.load(f)
+
+
+def _utm_epsg_for(lat: float, lon: float) -> int:
+    """EPSG code of the WGS84 UTM zone containing the given point."""
+    zone = int((lon + 180) // 6) + 1
+    return (32600 if lat >= 0 else 32700) + zone
+
+
+def _dump_json(obj, path):
+    """Serializes obj to path as indented JSON, via orjson when available."""
+    if orjson is not None:
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(obj, f, indent=2)
+
+
+def _fast_clone(src: str, dst: str):
+    """
+    Clones a file via hardlink when possible, falling back to a byte copy.
+    The filtered panoramas live on the same filesystem as their originals
+    (both inside the temp processing dir), so the hardlink path turns a
+    multi-megabyte copy into an O(1) metadata operation.
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        try:
+            os.symlink(os.path.abspath(src), dst)
+        except OSError:
+            shutil.copy2(src, dst)
+
+
 def deploy_single_building_standalone():
     # ========================== USER CONFIGURATION ==========================
     # --- Essential Input Paths ---
@@ -101,12 +169,8 @@ def deploy_single_building_standalone():
     
     CUBE_FACES_TO_EXTRACT_DEPLOY = ["front"]
 
-    MOVE_FILES_IN_FINAL_SORT = False
-
     MAPILLARY_TOOLS_EXEC_PATH = config.MAPILLARY_TOOLS_PATH
     COMPUTATION_DEVICE = config.DEVICE
-    
-    CLEANUP_TEMP_FULL_SAMPLING_DIR = True
     # ======================= END OF USER CONFIGURATION =======================
 
     print("Starting STANDALONE deployment for a single building...")
@@ -122,7 +186,7 @@ def deploy_single_building_standalone():
         return
 
     try:
-        gdf_all_buildings = gpd.read_file(BUILDING_FOOTPRINTS_GEOJSON_PATH)
+        gdf_all_buildings = load_footprints_cached(BUILDING_FOOTPRINTS_GEOJSON_PATH)
         if gdf_all_buildings.crs.to_epsg() != 4326:
             gdf_all_buildings = gdf_all_buildings.to_crs(epsg=4326)
     except Exception as e:
@@ -134,26 +198,38 @@ def deploy_single_building_standalone():
         print(f"Error: Neither 'BLD_ID' nor 'id' column found in {BUILDING_FOOTPRINTS_GEOJSON_PATH}.")
         return
 
+    # Clean the ID column once and build an O(1) BLD_ID -> row position index,
+    # instead of re-running a full-column cast+strip+compare for every lookup.
+    bld_ids_clean = gdf_all_buildings[id_column_name].astype(str).str.strip()
+    bld_id_to_iloc = pd.Series(np.arange(len(gdf_all_buildings)), index=bld_ids_clean)
+    # Multi-part buildings can repeat a BLD_ID; keep the first occurrence so
+    # lookups return a scalar position, matching the old boolean-mask
+    # behavior of using the first matching row.
+    bld_id_to_iloc = bld_id_to_iloc[~bld_id_to_iloc.index.duplicated()]
+
     if TARGET_BLD_ID:
         actual_target_bld_id = str(TARGET_BLD_ID).strip()
-        target_building_series = gdf_all_buildings[gdf_all_buildings[id_column_name].astype(str).str.strip() == actual_target_bld_id]
-        if target_building_series.empty:
+        if actual_target_bld_id not in bld_id_to_iloc.index:
             print(f"Error: Target BLD_ID '{actual_target_bld_id}' not found in GeoJSON using column '{id_column_name}'.")
             return
+        target_building_series = gdf_all_buildings.iloc[[bld_id_to_iloc[actual_target_bld_id]]]
         target_building_geometry = target_building_series.iloc[0].geometry
         target_building_centroid_wgs84 = target_building_geometry.centroid
         print(f"Targeting building by BLD_ID: {actual_target_bld_id}")
     elif TARGET_LATITUDE != 0.0 and TARGET_LONGITUDE != 0.0:
         print(f"Attempting to find closest building to LAT: {TARGET_LATITUDE}, LON: {TARGET_LONGITUDE}")
+        # Only the ID and geometry take part in the nearest search; the slim
+        # frame keeps the scan off the dozens of DINS attribute columns.
         bld_id_match, bld_lat, bld_lon, dist_m = find_closest_building_by_latlon(
-            TARGET_LATITUDE, TARGET_LONGITUDE, gdf_all_buildings, MAX_DIST_FOR_LATLON_MATCH_M
+            TARGET_LATITUDE, TARGET_LONGITUDE, gdf_all_buildings[[id_column_name, 'geometry']], MAX_DIST_FOR_LATLON_MATCH_M
         )
         if bld_id_match:
-            actual_target_bld_id = str(bld_id_match)
-            target_building_series = gdf_all_buildings[gdf_all_buildings[id_column_name].astype(str).str.strip() == actual_target_bld_id]
-            if target_building_series.empty:
+            # Normalize once here; every later use compares/builds on this key.
+            actual_target_bld_id = str(bld_id_match).strip()
+            if actual_target_bld_id not in bld_id_to_iloc.index:
                 print(f"Error: Could not re-fetch building {actual_target_bld_id} after matching by lat/lon.")
                 return
+            target_building_series = gdf_all_buildings.iloc[[bld_id_to_iloc[actual_target_bld_id]]]
             target_building_geometry = target_building_series.iloc[0].geometry
             target_building_centroid_wgs84 = Point(bld_lon, bld_lat)
             print(f"Found closest building: BLD_ID '{actual_target_bld_id}' at ({bld_lat:.6f}, {bld_lon:.6f}), distance: {dist_m:.2f}m.")
@@ -168,11 +244,21 @@ def deploy_single_building_standalone():
         print("Could not determine target building. Exiting.")
         return
 
-    safe_bld_id_dirname = actual_target_bld_id.replace(os.sep, "_").replace(" ", "_").replace(":", "_")
+    # The target row (with all attributes for the facade CSV) is isolated, so
+    # the city-scale footprints frame can be released to shrink the working set.
+    gdf_target_building_only = gpd.GeoDataFrame(target_building_series.copy(), crs=gdf_all_buildings.crs)
+    del gdf_all_buildings, bld_id_to_iloc
+
+    # Must match the sorter's sanitizer exactly: the success check below
+    # looks for the directory the sort stage wrote.
+    safe_bld_id_dirname = safe_dirname(actual_target_bld_id)
     final_building_output_dir = os.path.join(DEPLOYMENT_BASE_OUTPUT_DIR, safe_bld_id_dirname)
     ensure_dir_exists(final_building_output_dir)
 
-    with tempfile.TemporaryDirectory(prefix="pano_deploy_temp_") as temp_processing_dir_base:
+    # Keep the temp workspace on the same filesystem as the final outputs so the
+    # hardlink/rename fast paths apply. Note: temp space is drawn from the
+    # output volume rather than /tmp, so it must fit the full sampling run.
+    with tempfile.TemporaryDirectory(prefix="pano_deploy_temp_", dir=DEPLOYMENT_BASE_OUTPUT_DIR) as temp_processing_dir_base:
         print(f"Using temporary processing directory: {temp_processing_dir_base}")
 
         print("\n--- Running Stage: Full Video Sampling ---")
@@ -193,73 +279,104 @@ def deploy_single_building_standalone():
             return
         
         print("\n--- Running Stage: Filtering Panoramas near Target Building ---")
-        try:
-            with open(full_mapillary_meta_json_path, 'r', encoding='utf-8') as f:
-                all_pano_metadata = json.load(f)
-        except Exception as e:
-            print(f"Error reading full Mapillary metadata '{full_mapillary_meta_json_path}': {e}")
-            return
-
         filtered_pano_records = []
         active_panos_dir = os.path.join(temp_processing_dir_base, "01a_active_panos_for_target")
         ensure_dir_exists(active_panos_dir)
 
-        print(f"Filtering {len(all_pano_metadata)} total panoramas for those within {MAX_PANO_DISTANCE_TO_TARGET_BLD_M}m of target building centroid ({target_building_centroid_wgs84.y:.5f}, {target_building_centroid_wgs84.x:.5f})...")
-        for pano_meta in tqdm(all_pano_metadata, desc="Filtering Panos"):
-            try:
-                pano_lat = float(pano_meta["MAPLatitude"])
-                pano_lon = float(pano_meta["MAPLongitude"])
-                dist_to_target = calculate_distance_meters(
-                    pano_lat, pano_lon,
-                    target_building_centroid_wgs84.y, target_building_centroid_wgs84.x
-                )
+        print(f"Filtering panoramas for those within {MAX_PANO_DISTANCE_TO_TARGET_BLD_M}m of target building centroid ({target_building_centroid_wgs84.y:.5f}, {target_building_centroid_wgs84.x:.5f})...")
 
-                if dist_to_target <= MAX_PANO_DISTANCE_TO_TARGET_BLD_M:
-                    original_pano_path_str = pano_meta["filename"]
-                    original_pano_path = Path(original_pano_path_str)
-                    
-                    if not original_pano_path.is_file():
-                        json_dir = Path(full_mapillary_meta_json_path).parent
-                        candidate_path = (json_dir / original_pano_path_str).resolve()
-                        if candidate_path.is_file():
-                            original_pano_path = candidate_path
-                        else:
-                            print(f"Warning: Panorama file from JSON '{original_pano_path_str}' not found. Skipping.")
-                            continue
-                        
-                    new_pano_basename = original_pano_path.name
-                    new_pano_path = os.path.join(active_panos_dir, new_pano_basename)
-                    shutil.copy2(str(original_pano_path), new_pano_path)
-                    
-                    updated_meta_record = dict(pano_meta)
-                    updated_meta_record["filename"] = new_pano_path
-                    filtered_pano_records.append(updated_meta_record)
-
-            except (KeyError, ValueError, TypeError) as e_filter:
-                print(f"Warning: Skipping a panorama record due to missing/invalid data ('{str(e_filter)}'). Record: {str(pano_meta)[:100]}...")
-                continue
+        # Stream records while pre-validating, so the vectorized distance pass
+        # only sees clean lat/lon values and the raw JSON list is never held whole.
+        valid_pano_records = []
+        total_pano_records = 0
+        try:
+            for pano_meta in _iter_pano_records(full_mapillary_meta_json_path):
+                total_pano_records += 1
+                try:
+                    float(pano_meta["MAPLatitude"])
+                    float(pano_meta["MAPLongitude"])
+                    valid_pano_records.append(pano_meta)
+                except (KeyError, ValueError, TypeError) as e_filter:
+                    print(f"Warning: Skipping a panorama record due to missing/invalid data ('{str(e_filter)}'). Record: {str(pano_meta)[:100]}...")
+        except Exception as e:
+            print(f"Error reading full Mapillary metadata '{full_mapillary_meta_json_path}': {e}")
+            return
+        print(f"Scanned {total_pano_records} panorama records; {len(valid_pano_records)} with valid coordinates.")
+
+        if valid_pano_records:
+            # Project all pano points into the local UTM zone in one vectorized
+            # transform; at this working radius a plain Euclidean distance is
+            # accurate and avoids per-point spherical trig entirely.
+            lats = np.fromiter((float(m["MAPLatitude"]) for m in valid_pano_records), dtype=np.float64, count=len(valid_pano_records))
+            lons = np.fromiter((float(m["MAPLongitude"]) for m in valid_pano_records), dtype=np.float64, count=len(valid_pano_records))
+            tgt_lat = target_building_centroid_wgs84.y
+            tgt_lon = target_building_centroid_wgs84.x
+            utm_transformer = get_transformer(4326, _utm_epsg_for(tgt_lat, tgt_lon))
+            xs, ys = utm_transformer.transform(lons, lats)
+            tgt_x, tgt_y = utm_transformer.transform(tgt_lon, tgt_lat)
+            dists_to_target = np.hypot(xs - tgt_x, ys - tgt_y)
+            nearby_record_indices = np.nonzero(dists_to_target <= MAX_PANO_DISTANCE_TO_TARGET_BLD_M)[0]
+        else:
+            nearby_record_indices = []
+
+        clone_pairs = []  # (src, dst) pairs for the blur-stage subset, cloned in parallel below
+        for record_idx in tqdm(nearby_record_indices, desc="Filtering Panos"):
+            pano_meta = valid_pano_records[record_idx]
+            original_pano_path_str = pano_meta["filename"]
+            original_pano_path = Path(original_pano_path_str)
+
+            if not original_pano_path.is_file():
+                json_dir = Path(full_mapillary_meta_json_path).parent
+                candidate_path = (json_dir / original_pano_path_str).resolve()
+                if candidate_path.is_file():
+                    original_pano_path = candidate_path
+                else:
+                    print(f"Warning: Panorama file from JSON '{original_pano_path_str}' not found. Skipping.")
+                    continue
+
+            # Records are not reused after filtering, so mutate in place
+            # instead of copying every accepted dict.
+            updated_meta_record = pano_meta
+            if ENABLE_IMAGE_BLURRING:
+                # The blur stage scans its source directory for images, so it needs
+                # a materialized subset containing only the filtered panoramas.
+                new_pano_path = os.path.join(active_panos_dir, original_pano_path.name)
+                clone_pairs.append((str(original_pano_path), new_pano_path))
+                updated_meta_record["filename"] = new_pano_path
+            else:
+                # Pure path indirection: downstream stages resolve panoramas via the
+                # absolute paths in the filtered JSON, so no files need to move.
+                updated_meta_record["filename"] = str(original_pano_path)
+            filtered_pano_records.append(updated_meta_record)
+
+        if clone_pairs:
+            # Clones are I/O-bound syscalls that release the GIL; fanning them out
+            # over a thread pool keeps multiple requests outstanding on the disk.
+            with ThreadPoolExecutor(max_workers=16) as clone_executor:
+                list(clone_executor.map(lambda pair: _fast_clone(*pair), clone_pairs))
         
         if not filtered_pano_records:
             print(f"No panoramas found near BLD_ID '{actual_target_bld_id}'. Deployment cannot proceed.")
-            if CLEANUP_TEMP_FULL_SAMPLING_DIR and os.path.exists(full_sampled_images_dir_in_temp):
-                 shutil.rmtree(full_sampled_images_dir_in_temp)
             return
 
         print(f"Found {len(filtered_pano_records)} panoramas relevant to the target building.")
         
         filtered_mapillary_meta_json_path = os.path.join(active_panos_dir, "filtered_mapillary_description.json")
-        with open(filtered_mapillary_meta_json_path, 'w', encoding='utf-8') as f:
-            json.dump(filtered_pano_records, f, indent=2)
+        _dump_json(filtered_pano_records, filtered_mapillary_meta_json_path)
+
+        # When blurring is off, no filtered images were materialized: downstream
+        # stages read the originals via the absolute paths in the filtered JSON.
+        current_pano_source_dir_for_processing = active_panos_dir if ENABLE_IMAGE_BLURRING else full_sampled_images_dir_in_temp
 
         # --- *** NEW STAGE: Interactive Offset Measurement (Optional) *** ---
         if RUN_INTERACTIVE_OFFSET_MEASUREMENT_DEPLOY:
             print("\n--- Running Stage: Interactive Offset Measurement (Deployment) ---")
-            if not active_panos_dir or not filtered_mapillary_meta_json_path:
+            if not current_pano_source_dir_for_processing or not filtered_mapillary_meta_json_path:
                 print("Error: Cannot run offset measurement. Filtered panorama source directory or metadata JSON is missing.")
             else:
                 # Ensure offset.py (or your renamed script) is imported correctly
                 measured_offset = offset.measure_yaw_offset_interactively(
-                    panoramas_image_dir=active_panos_dir, # Use the directory with filtered images
+                    panoramas_image_dir=current_pano_source_dir_for_processing, # Use the directory with filtered images
                     mapillary_image_description_json_path=filtered_mapillary_meta_json_path # Use metadata for filtered images
                 )
                 if measured_offset is not None: # Can be 0.0, which is valid
@@ -272,7 +389,6 @@ def deploy_single_building_standalone():
             print(f"Using predetermined PANO_ZERO_OFFSET_FOR_ROTATION: {pano_zero_offset_for_rotation:+.2f}°")
         # --- *** END OF NEW STAGE *** ---
 
-        current_pano_source_dir_for_processing = active_panos_dir
         current_mapillary_meta_for_facade_processing = filtered_mapillary_meta_json_path
 
         if ENABLE_IMAGE_BLURRING:
@@ -294,28 +410,26 @@ def deploy_single_building_standalone():
                 print(f"Blurred active panoramas generated in: {current_pano_source_dir_for_processing}")
                 
                 print("Updating metadata to reflect blurred image paths for facade processing...")
+                # One readdir instead of a stat call per panorama; records are
+                # mutated in place since filtered_pano_records is not reused.
+                blurred_files_present = set(os.listdir(blurred_active_panos_dir))
                 updated_records_for_blurred_files = []
                 for record in filtered_pano_records:
                     original_basename_in_active_dir = Path(record["filename"]).name
                     blurred_filename_expected = original_basename_in_active_dir.rsplit(".", 1)[0] + "_blurred.jpg"
-                    path_to_blurred_file = os.path.join(blurred_active_panos_dir, blurred_filename_expected)
 
-                    if os.path.exists(path_to_blurred_file):
-                        new_record = dict(record) 
-                        new_record["filename"] = path_to_blurred_file
-                        updated_records_for_blurred_files.append(new_record)
+                    if blurred_filename_expected in blurred_files_present:
+                        record["filename"] = os.path.join(blurred_active_panos_dir, blurred_filename_expected)
+                        updated_records_for_blurred_files.append(record)
                     else:
-                        print(f"Warning: Expected blurred file {path_to_blurred_file} not found. Original record: {record['filename']}")
+                        print(f"Warning: Expected blurred file {blurred_filename_expected} not found in {blurred_active_panos_dir}. Original record: {record['filename']}")
                 
                 if not updated_records_for_blurred_files:
                     print("Error: Blurring enabled, but no blurred files could be mapped for metadata update. Cannot proceed.")
-                    if CLEANUP_TEMP_FULL_SAMPLING_DIR and os.path.exists(full_sampled_images_dir_in_temp):
-                        shutil.rmtree(full_sampled_images_dir_in_temp)
                     return
                 
                 current_mapillary_meta_for_facade_processing = os.path.join(blurred_active_panos_dir, "blurred_mapillary_description.json")
-                with open(current_mapillary_meta_for_facade_processing, 'w', encoding='utf-8') as f:
-                    json.dump(updated_records_for_blurred_files, f, indent=2)
+                _dump_json(updated_records_for_blurred_files, current_mapillary_meta_for_facade_processing)
                 print(f"Metadata for blurred images saved to: {current_mapillary_meta_for_facade_processing}")
             else:
                 print("Image blurring failed or produced no output directory. Proceeding with unblurred images.")
@@ -323,46 +437,38 @@ def deploy_single_building_standalone():
             print("\n--- Skipping Stage: Image Blurring ---")
 
         print("\n--- Running Stage: Façade Processing (Targeted) ---")
-        gdf_target_building_only = gpd.GeoDataFrame(
-            [gdf_all_buildings[gdf_all_buildings[id_column_name].astype(str).str.strip() == actual_target_bld_id].iloc[0]],
-            crs=gdf_all_buildings.crs
-        )
-        temp_target_geojson_path = os.path.join(temp_processing_dir_base, "target_building_temp.geojson")
-        try:
-            gdf_target_building_only.to_file(temp_target_geojson_path, driver="GeoJSON")
-        except Exception as e_to_file:
-            print(f"Error writing temporary target GeoJSON: {e_to_file}")
-            return
-
-        target_facade_matches_csv = process_facade.process_building_footprints(
+        # Hand the single-building GeoDataFrame to the façade stage in-process,
+        # skipping the temp-GeoJSON serialize/parse round-trip.
+        target_facade_matches_csv, target_facade_rows = process_facade.process_building_footprints(
             mapillary_image_description_json_path=current_mapillary_meta_for_facade_processing,
-            footprint_geojson_path=temp_target_geojson_path,
+            footprint_geojson_path=BUILDING_FOOTPRINTS_GEOJSON_PATH,
             base_output_dir=temp_processing_dir_base,
             max_distance_to_building_m=MAX_PANO_DISTANCE_TO_TARGET_BLD_M,
-            frontal_view_tolerance_deg=FRONTAL_TOL_DEG_DEPLOY
+            frontal_view_tolerance_deg=FRONTAL_TOL_DEG_DEPLOY,
+            _footprint_gdf_override=gdf_target_building_only
         )
-        if os.path.exists(temp_target_geojson_path):
-            os.remove(temp_target_geojson_path)
 
-        if not target_facade_matches_csv or not (os.path.exists(target_facade_matches_csv) and pd.read_csv(target_facade_matches_csv).shape[0] > 0):
+        # The façade stage returns its rows in-memory alongside the CSV, so
+        # emptiness is a plain truthiness check rather than a CSV re-parse.
+        if not target_facade_matches_csv or not target_facade_rows:
             print(f"Façade processing for BLD_ID '{actual_target_bld_id}' produced no valid matches. Deployment cannot proceed.")
-            if CLEANUP_TEMP_FULL_SAMPLING_DIR and os.path.exists(full_sampled_images_dir_in_temp):
-                 shutil.rmtree(full_sampled_images_dir_in_temp)
             return
         print(f"Facade processing complete. Matches CSV: {target_facade_matches_csv}")
 
         print("\n--- Running Stage: Panorama Rotation (Targeted) ---")
-        rotated_panos_dir_target, rotated_panos_meta_target = rotate.rotate_panoramas_to_facades(
+        rotated_panos_dir_target, rotated_panos_meta_target, rotated_records_target = rotate.rotate_panoramas_to_facades(
             facade_matches_csv_path=target_facade_matches_csv,
             source_panoramas_dir=current_pano_source_dir_for_processing, # This dir contains images referenced by CSV (now possibly blurred)
             base_output_dir=temp_processing_dir_base,
             measured_camera_offset_deg=pano_zero_offset_for_rotation, # Use the determined offset
-            distance_cutoff_m=ROTATION_DIST_CUTOFF_M_DEPLOY
+            distance_cutoff_m=ROTATION_DIST_CUTOFF_M_DEPLOY,
+            facade_matches_rows=target_facade_rows,
+            # The rotated JPGs are never shipped (only cube faces are sorted
+            # out of the temp tree), so defer the roll to extraction.
+            write_rotated_images=False
         )
         if not rotated_panos_dir_target or not rotated_panos_meta_target:
             print(f"Panorama rotation failed for BLD_ID '{actual_target_bld_id}'.")
-            if CLEANUP_TEMP_FULL_SAMPLING_DIR and os.path.exists(full_sampled_images_dir_in_temp):
-                 shutil.rmtree(full_sampled_images_dir_in_temp)
             return
 
         print("\n--- Running Stage: Cube Face Extraction (Targeted) ---")
@@ -371,51 +477,43 @@ def deploy_single_building_standalone():
         else:
             faces_to_extract_final = CUBE_FACES_TO_EXTRACT_DEPLOY
         
-        cube_faces_dir_target, cube_faces_meta_target = extract_cube.extract_cubemap_faces(
+        cube_faces_dir_target, cube_faces_meta_target, cube_records_target = extract_cube.extract_cubemap_faces(
             rotated_panoramas_meta_json_path=rotated_panos_meta_target,
             base_output_dir=temp_processing_dir_base,
-            faces_to_extract=faces_to_extract_final
+            faces_to_extract=faces_to_extract_final,
+            rotated_records=rotated_records_target
         )
         if not cube_faces_dir_target or not cube_faces_meta_target:
             print(f"Cube face extraction failed for BLD_ID '{actual_target_bld_id}'.")
-            if CLEANUP_TEMP_FULL_SAMPLING_DIR and os.path.exists(full_sampled_images_dir_in_temp):
-                 shutil.rmtree(full_sampled_images_dir_in_temp)
             return
 
         print("\n--- Running Stage: Output Sorting (Targeted) ---")
-        temp_final_sorted_base = os.path.join(temp_processing_dir_base, "final_sort_temp_base")
-        ensure_dir_exists(temp_final_sorted_base)
-
-        path_to_intermediate_sorted_dir = sort.sort_cube_faces_by_building(
+        # Suffix "" matches any file, so this is a short-circuiting
+        # "directory already has outputs" probe rather than a full listing.
+        if has_file_with_suffix(final_building_output_dir, ""):
+            print(f"Warning: Final output directory '{final_building_output_dir}' is not empty. Contents might be overwritten or merged.")
+
+        # Sort straight into the deployment output root: the sorter creates
+        # <base>/<safe_bld_id> itself, which is exactly final_building_output_dir,
+        # so the previous copy of every cube-face PNG out of the temp dir is
+        # gone entirely. move_files=True renames the PNGs out of the doomed
+        # temp tree (same filesystem, since the temp dir is co-located).
+        path_to_sorted_dir = sort.sort_cube_faces_by_building(
             cube_faces_metadata_json_path=cube_faces_meta_target,
-            base_output_dir=temp_final_sorted_base, 
+            final_sorted_dir=DEPLOYMENT_BASE_OUTPUT_DIR,
             building_damage_csv_path=BUILDING_DAMAGE_CSV_PATH,
-            move_files=False 
+            move_files=True,
+            cube_face_records=cube_records_target
         )
 
-        if path_to_intermediate_sorted_dir:
-            source_dir_for_final_copy = os.path.join(path_to_intermediate_sorted_dir, safe_bld_id_dirname)
-            
-            if os.path.isdir(source_dir_for_final_copy):
-                print(f"Copying final sorted outputs from '{source_dir_for_final_copy}' to '{final_building_output_dir}'")
-                if os.path.exists(final_building_output_dir) and os.listdir(final_building_output_dir):
-                     print(f"Warning: Final output directory '{final_building_output_dir}' is not empty. Contents might be overwritten or merged.")
-                
-                shutil.copytree(source_dir_for_final_copy, final_building_output_dir, dirs_exist_ok=True)
-                print(f"Final sorted outputs for BLD_ID '{actual_target_bld_id}' are in: {final_building_output_dir}")
-            else:
-                print(f"Error: Expected sorted directory '{source_dir_for_final_copy}' not found after sorting operation.")
+        if path_to_sorted_dir and os.path.isdir(final_building_output_dir):
+            print(f"Final sorted outputs for BLD_ID '{actual_target_bld_id}' are in: {final_building_output_dir}")
         else:
             print(f"Output sorting failed for BLD_ID '{actual_target_bld_id}'.")
 
-        if CLEANUP_TEMP_FULL_SAMPLING_DIR:
-            if full_sampled_images_dir_in_temp and os.path.exists(full_sampled_images_dir_in_temp):
-                print(f"Cleaning up full sampling directory: {full_sampled_images_dir_in_temp}")
-                try:
-                    shutil.rmtree(full_sampled_images_dir_in_temp)
-                except Exception as e_cleanup:
-                    print(f"Warning: Could not cleanup {full_sampled_images_dir_in_temp}: {e_cleanup}")
-        
+        # No explicit cleanup of full_sampled_images_dir_in_temp: the enclosing
+        # TemporaryDirectory context removes the whole tree once, on exit.
+
     print(f"\nStandalone deployment script finished for BLD_ID '{actual_target_bld_id}'.")
     print(f"Final outputs should be in: {final_building_output_dir}")
 
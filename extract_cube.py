@@ -7,18 +7,377 @@ Outputs the paths to these cube faces along with consolidated metadata in a JSON
 """
 import os
 import json
+import hashlib
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache, partial
 import numpy as np
-from PIL import Image
-from equilib import equi2cube 
+import cv2
+from equilib import equi2cube
 from tqdm import tqdm
 from utils import ensure_dir_exists
-from config import ALL_POSSIBLE_CUBE_FACES # Using the list from config
+from config import ALL_POSSIBLE_CUBE_FACES, DEVICE # Using the list from config
+
+# torch is only needed for the optional CUDA fast path; the CPU process-pool
+# path works without it.
+try:
+    import torch
+except ImportError:
+    torch = None
+
+# orjson decodes/encodes the metadata JSON several times faster than stdlib
+# json on these dict-heavy payloads; optional dependency.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Panoramas per batched GPU equi2cube call; sized so a batch of 8K panos in
+# fp16 stays well inside typical VRAM budgets.
+GPU_BATCH_SIZE = 8
+
+# Face name -> position in equi2cube's 'list' output, computed once.
+_FACE_INDEX = {name: i for i, name in enumerate(ALL_POSSIBLE_CUBE_FACES)}
+
+# The four lateral faces are all the zero-rotation front face of a panorama
+# yawed by a quarter-turn multiple, and a pure yaw is an exact column roll of
+# the equirectangular image. Fraction of the panorama width to roll per face.
+_LATERAL_FACE_SHIFTS = {"front": 0.0, "right": 0.25, "back": 0.5, "left": 0.75}
+
+
+@lru_cache(maxsize=4)
+def _front_face_maps(equi_h, equi_w, w_face):
+    """
+    Equirectangular sampling maps (for cv2.remap) of the zero-rotation front
+    cube face. Cached per panorama shape, so the trigonometry runs once per
+    unique resolution instead of once per panorama.
+    """
+    # Face-plane coordinates in [-1, 1] at pixel centers; x right, y down.
+    rng = (np.arange(w_face, dtype=np.float32) + 0.5) * (2.0 / w_face) - 1.0
+    xs, ys = np.meshgrid(rng, rng)
+    # Ray (xs, ys, 1) through the face plane -> spherical lon/lat.
+    lon = np.arctan2(xs, 1.0)
+    lat = np.arctan2(-ys, np.sqrt(1.0 + xs * xs))
+    map_x = ((lon / (2.0 * np.pi) + 0.5) * equi_w - 0.5).astype(np.float32)
+    map_y = ((0.5 - lat / np.pi) * equi_h - 0.5).astype(np.float32)
+    # Packed 16-bit fixed-point maps: half the cache footprint and the
+    # faster SIMD path inside cv2.remap.
+    return cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+
+
+def _resolve_rotated_path(record, rotated_images_source_dir):
+    """Returns the Path of the panorama to sample for a record, or None with a warning."""
+    if record.get("rotation_deferred"):
+        # The rotation stage never wrote a rotated JPG for this record; the
+        # source panorama is read directly and the yaw roll applied here.
+        source_pano_path = Path(record.get("source_pano_path", ""))
+        if not source_pano_path.is_file():
+            print(f"Warning: Source panorama '{source_pano_path}' for deferred rotation not found. Skipping.")
+            return None
+        return source_pano_path
+
+    # The key in the JSON should point to the filename of the rotated image
+    rotated_image_filename = record.get("rotated_image_path_relative")
+    if not rotated_image_filename:
+        # Fallback for compatibility with older 'rotate.py' versions
+        rotated_image_filename = Path(record.get("rotated_pano_path", "")).name
+
+    if not rotated_image_filename:
+        print(f"Warning: Could not find rotated panorama path in record. Skipping.")
+        return None
+
+    rotated_pano_path = Path(rotated_images_source_dir) / rotated_image_filename
+
+    if not rotated_pano_path.is_file():
+        print(f"Warning: Rotated panorama file '{rotated_pano_path}' not found. Skipping.")
+        return None
+    return rotated_pano_path
+
+
+def _record_stem(record, pano_path):
+    """Stem for a record's face filenames: the (possibly never written)
+    rotated image name for deferred rotations, else the panorama's own."""
+    if record.get("rotation_deferred"):
+        return Path(record.get("rotated_pano_path", "")).stem or pano_path.stem
+    return pano_path.stem
+
+
+def _apply_deferred_yaw(record, img_hwc):
+    """
+    Applies the yaw roll the rotation stage deferred to this stage. A pure-yaw
+    rotation of an equirectangular image is an exact horizontal column shift
+    with wrap-around, so this costs one np.roll instead of a resample.
+    """
+    if not record.get("rotation_deferred"):
+        return img_hwc
+    yaw_deg = float(record.get("applied_yaw_rotation_deg", 0.0))
+    pano_width = img_hwc.shape[1]
+    shift_cols = int(round(yaw_deg / 360.0 * pano_width)) % pano_width
+    if shift_cols:
+        img_hwc = np.roll(img_hwc, -shift_cols, axis=1)
+    return img_hwc
+
+
+def _deferred_yaw_tag(record):
+    """Quantised yaw identity used for cache and duplicate comparisons."""
+    return round(float(record.get("applied_yaw_rotation_deg", 0.0)), 3)
+
+
+def _yaw_sidecar_path(output_stem, cubeface_images_dir):
+    return Path(cubeface_images_dir) / f"{output_stem}.cache.json"
+
+
+def _write_yaw_sidecar(record, output_stem, cubeface_images_dir):
+    """
+    Records the yaw that a deferred-rotation record's faces were rendered
+    with. Without it a rerun cannot tell stale faces from fresh ones after
+    the camera offset changes: the deferred path samples the unrotated
+    source panorama, whose mtime never moves when only the yaws do.
+    """
+    if not record.get("rotation_deferred"):
+        return
+    try:
+        _yaw_sidecar_path(output_stem, cubeface_images_dir).write_text(
+            json.dumps({"applied_yaw_rotation_deg": _deferred_yaw_tag(record)}))
+    except OSError as e_sidecar:
+        print(f"Warning: Could not write yaw sidecar for '{output_stem}': {e_sidecar}")
+
+
+def _cached_faces_record(record, rotated_pano_path, faces_to_extract, cubeface_images_dir):
+    """
+    Returns an updated record reusing already-extracted face PNGs, or None if
+    any requested face is missing or older than the source panorama — or, for
+    deferred rotations, rendered with a different yaw than the record asks
+    for. Makes reruns over the same output directory skip the resampling
+    entirely.
+    """
+    try:
+        source_mtime = rotated_pano_path.stat().st_mtime
+        output_stem = _record_stem(record, rotated_pano_path)
+        if record.get("rotation_deferred"):
+            # The mtime check below compares against the unrotated source
+            # panorama, which does not change when a new camera offset
+            # produces new yaws; the sidecar written at extraction time
+            # carries the yaw the faces were actually baked with.
+            try:
+                sidecar = json.loads(_yaw_sidecar_path(output_stem, cubeface_images_dir).read_text())
+            except (OSError, ValueError):
+                return None
+            if sidecar.get("applied_yaw_rotation_deg") != _deferred_yaw_tag(record):
+                return None
+        cached_face_paths = {}
+        for face_name in faces_to_extract:
+            face_filename = f"{output_stem}_{face_name}.png"
+            face_path = Path(cubeface_images_dir) / face_filename
+            if not face_path.is_file() or face_path.stat().st_mtime < source_mtime:
+                return None
+            cached_face_paths[face_name] = face_filename
+    except OSError:
+        return None
+    updated_record = dict(record)
+    updated_record["extracted_cube_faces"] = cached_face_paths
+    return updated_record
+
+
+def _save_faces(list_of_cube_faces_chw, base_filename_no_ext, faces_to_extract, cubeface_images_dir,
+                save_executor=None):
+    """
+    Writes the requested faces (CHW numpy arrays) as PNGs; returns {face: filename}.
+    When save_executor is given, the PNG encodes (which release the GIL) are
+    submitted to it instead of blocking the caller; the executor owner must
+    shut it down with wait=True before trusting the files on disk.
+    """
+    saved_face_paths = {}
+    # Touch only the requested faces: with the default ["front"] this skips the
+    # clip/transpose/encode work on the other five faces entirely.
+    for current_face_name in faces_to_extract:
+        face_idx = _FACE_INDEX.get(current_face_name)
+        if face_idx is None:
+            continue
+        # Accepts either equi2cube's full list or a {face_idx: array} subset.
+        face_chw_data = list_of_cube_faces_chw[face_idx]
+
+        # One fused cast-and-densify pass over the HWC view: equi2cube already
+        # clips its output to [0, 255] (clip_output defaults to True), so a
+        # separate np.clip temp is unnecessary, and astype on the transposed
+        # view writes a contiguous uint8 buffer directly. GPU-path faces arrive
+        # pre-clamped as uint8 and only need densifying.
+        face_hwc_view = face_chw_data.transpose(1, 2, 0)
+        if face_chw_data.dtype == np.uint8:
+            face_hwc_data = np.ascontiguousarray(face_hwc_view)
+        else:
+            face_hwc_data = face_hwc_view.astype(np.uint8)
+        # cvtColor produces a fresh dense array, so it is safe to hand to a
+        # background writer without copying.
+        face_bgr_data = cv2.cvtColor(face_hwc_data, cv2.COLOR_RGB2BGR)
+
+        face_output_filename = f"{base_filename_no_ext}_{current_face_name}.png"
+        face_output_path = f"{cubeface_images_dir}{os.sep}{face_output_filename}"
+
+        # libpng level 3 trades a slightly larger file for a much
+        # faster encode than PIL's default.
+        write_args = (face_output_path, face_bgr_data, [cv2.IMWRITE_PNG_COMPRESSION, 3])
+        if save_executor is not None:
+            save_executor.submit(cv2.imwrite, *write_args)
+        else:
+            cv2.imwrite(*write_args)
+        saved_face_paths[current_face_name] = face_output_filename
+    return saved_face_paths
+
+
+def _extract_one(record, rotated_images_source_dir, faces_to_extract, cubeface_images_dir,
+                 save_executor=None):
+    """
+    Extracts the requested cube faces for a single rotated panorama record.
+    Runs inside a worker process; returns the updated metadata record, or
+    None if the panorama could not be processed.
+    """
+    rotated_pano_path = _resolve_rotated_path(record, rotated_images_source_dir)
+    if rotated_pano_path is None:
+        return None
+
+    cached_record = _cached_faces_record(record, rotated_pano_path, faces_to_extract, cubeface_images_dir)
+    if cached_record is not None:
+        return cached_record
+
+    try:
+        # IMREAD_COLOR decodes via libjpeg-turbo and normalizes grayscale/RGBA
+        # sources to 3 channels in one step.
+        img_bgr = cv2.imread(str(rotated_pano_path), cv2.IMREAD_COLOR)
+        if img_bgr is None:
+            print(f"Warning: Could not read rotated panorama '{rotated_pano_path}'. Skipping.")
+            return None
+        img_bgr = _apply_deferred_yaw(record, img_bgr)
+        output_stem = _record_stem(record, rotated_pano_path)
+
+        if set(faces_to_extract) <= set(_LATERAL_FACE_SHIFTS):
+            # Fast path for lateral faces (the deploy default is just "front"):
+            # each is the front face of a column-rolled view of the panorama,
+            # so one cached-map cv2.remap per face replaces equi2cube's
+            # six-face gather. remap samples the uint8 BGR buffer directly —
+            # no float upcast and no color conversions anywhere on this path.
+            map_x, map_y = _front_face_maps(img_bgr.shape[0], img_bgr.shape[1], img_bgr.shape[1] // 4)
+            pano_width = img_bgr.shape[1]
+            saved_face_paths = {}
+            for face_name in faces_to_extract:
+                shift_cols = int(round(_LATERAL_FACE_SHIFTS[face_name] * pano_width)) % pano_width
+                face_source = np.roll(img_bgr, -shift_cols, axis=1) if shift_cols else img_bgr
+                face_bgr = cv2.remap(face_source, map_x, map_y, cv2.INTER_LINEAR, borderMode=cv2.BORDER_WRAP)
+                face_output_filename = f"{output_stem}_{face_name}.png"
+                face_output_path = f"{cubeface_images_dir}{os.sep}{face_output_filename}"
+                write_args = (face_output_path, face_bgr, [cv2.IMWRITE_PNG_COMPRESSION, 3])
+                if save_executor is not None:
+                    save_executor.submit(cv2.imwrite, *write_args)
+                else:
+                    cv2.imwrite(*write_args)
+                saved_face_paths[face_name] = face_output_filename
+            _write_yaw_sidecar(record, output_stem, cubeface_images_dir)
+            updated_record = dict(record)
+            updated_record["extracted_cube_faces"] = saved_face_paths
+            return updated_record
+
+        img_array_hwc = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
+
+        # Densify the CHW buffer so equi2cube's row sweeps read contiguously
+        # instead of stride-hopping over a transposed view.
+        img_array_chw = np.ascontiguousarray(img_array_hwc.transpose(2, 0, 1))
+        cube_face_width = img_array_hwc.shape[1] // 4
+
+        list_of_cube_faces_chw = equi2cube(
+            equi=img_array_chw,
+            rots={"roll": 0.0, "pitch": 0.0, "yaw": 0.0},
+            w_face=cube_face_width,
+            cube_format='list'
+        )
+
+        saved_face_paths = _save_faces(list_of_cube_faces_chw, output_stem,
+                                       faces_to_extract, cubeface_images_dir, save_executor)
+        _write_yaw_sidecar(record, output_stem, cubeface_images_dir)
+
+        updated_record = dict(record)
+        updated_record["extracted_cube_faces"] = saved_face_paths
+        return updated_record
+
+    except Exception as e_extract:
+        print(f"Error extracting cube faces for {rotated_pano_path}: {e_extract}")
+        return None
+
+
+def _extract_batch_gpu(batch_records, rotated_images_source_dir, faces_to_extract, cubeface_images_dir,
+                       save_executor=None):
+    """
+    Stacks a batch of equally-sized rotated panoramas into one fp16 CUDA tensor
+    and issues a single batched equi2cube call. Records whose panorama cannot
+    be batched (odd size, decode failure) fall back to the CPU worker.
+    Returns the list of updated metadata records for the batch.
+    """
+    updated_records = []
+    decoded = []  # (record, stem, contiguous CHW uint8 array)
+    for record in batch_records:
+        rotated_pano_path = _resolve_rotated_path(record, rotated_images_source_dir)
+        if rotated_pano_path is None:
+            continue
+        cached_record = _cached_faces_record(record, rotated_pano_path, faces_to_extract, cubeface_images_dir)
+        if cached_record is not None:
+            updated_records.append(cached_record)
+            continue
+        img_bgr = cv2.imread(str(rotated_pano_path), cv2.IMREAD_COLOR)
+        if img_bgr is None:
+            print(f"Warning: Could not read rotated panorama '{rotated_pano_path}'. Skipping.")
+            continue
+        img_rgb = _apply_deferred_yaw(record, cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB))
+        decoded.append((record, _record_stem(record, rotated_pano_path), np.ascontiguousarray(img_rgb.transpose(2, 0, 1))))
+
+    if not decoded:
+        return updated_records
+
+    # Only same-shaped panoramas can share a stacked tensor (the usual case for
+    # frames of one video); stragglers go through the scalar CPU path below.
+    batch_shape = decoded[0][2].shape
+    stackable = [entry for entry in decoded if entry[2].shape == batch_shape]
+    stragglers = [entry[0] for entry in decoded if entry[2].shape != batch_shape]
+
+    try:
+        # fp16 halves HBM traffic; bilinear sampling is tolerant of the precision.
+        equi_batch = torch.from_numpy(np.stack([entry[2] for entry in stackable])).to(DEVICE).half()
+        batched_faces = equi2cube(
+            equi=equi_batch,
+            rots=[{"roll": 0.0, "pitch": 0.0, "yaw": 0.0}] * len(stackable),
+            w_face=batch_shape[2] // 4,
+            cube_format='list'
+        )
+        gpu_records = []
+        for (record, stem, _), faces in zip(stackable, batched_faces):
+            # Move only the requested faces back to host memory.
+            faces_np = {
+                _FACE_INDEX[name]: faces[_FACE_INDEX[name]].float().clamp(0, 255).to(torch.uint8).cpu().numpy()
+                for name in faces_to_extract if name in _FACE_INDEX
+            }
+            saved_face_paths = _save_faces(faces_np, stem, faces_to_extract, cubeface_images_dir, save_executor)
+            _write_yaw_sidecar(record, stem, cubeface_images_dir)
+            updated_record = dict(record)
+            updated_record["extracted_cube_faces"] = saved_face_paths
+            gpu_records.append(updated_record)
+        updated_records.extend(gpu_records)
+    except Exception as e_gpu:
+        print(f"Warning: Batched GPU extraction failed ('{e_gpu}'). Falling back to CPU for this batch.")
+        stragglers = [entry[0] for entry in decoded]
+
+    for record in stragglers:
+        updated_record = _extract_one(record, rotated_images_source_dir, faces_to_extract, cubeface_images_dir,
+                                      save_executor)
+        if updated_record is not None:
+            updated_records.append(updated_record)
+
+    return updated_records
+
 
 def extract_cubemap_faces(
     rotated_panoramas_meta_json_path: str,
     base_output_dir: str,
-    faces_to_extract: list # List of face names like ["front", "left"]
+    faces_to_extract: list, # List of face names like ["front", "left"]
+    rotated_records: list = None, # Optional in-memory records from the rotation stage
+    max_workers: int = None # CPU worker budget; None means all cores
 ):
     """
     Converts rotated panoramas to cubemaps and saves selected faces.
@@ -27,9 +386,18 @@ def extract_cubemap_faces(
         rotated_panoramas_meta_json_path (str): Path to JSON metadata from the rotation stage.
         base_output_dir (str): Base directory for the current video's pipeline outputs.
         faces_to_extract (list): A list of strings specifying which cube faces to save.
+        rotated_records (list): Optional rotation metadata records handed over
+            in-memory by a same-process rotation stage. When given, the JSON at
+            rotated_panoramas_meta_json_path is not parsed (it is still used to
+            locate the rotated image files next to it).
+        max_workers (int): Size of the CPU extraction process pool. Callers
+            that already run several videos in parallel should pass their
+            per-video share of the cores so the pools do not multiply.
 
     Returns:
-        A tuple (path_to_images_directory, path_to_metadata_json) or (None, None).
+        A tuple (path_to_images_directory, path_to_metadata_json, metadata_records)
+        or (None, None, None). metadata_records is the in-memory list written to
+        the metadata JSON, for same-process handoff to the sorting stage.
     """
     # --- Setup paths using pathlib for robustness ---
     video_output_dir = Path(base_output_dir)
@@ -46,92 +414,141 @@ def extract_cubemap_faces(
         
     if not meta_json_path.is_file():
         print(f"Error: Rotated panoramas metadata JSON not found at {meta_json_path}")
-        return None, None
+        return None, None, None
 
-    try:
-        with open(meta_json_path, 'r') as f:
-            rotated_pano_records = json.load(f)
-    except Exception as e:
-        print(f"Error reading rotated panoramas metadata: {e}")
-        return None, None
+    if rotated_records is not None:
+        # Records handed over in-memory by the rotation stage: skip the parse.
+        rotated_pano_records = rotated_records
+    else:
+        try:
+            if orjson is not None:
+                with open(meta_json_path, 'rb') as f:
+                    rotated_pano_records = orjson.loads(f.read())
+            else:
+                with open(meta_json_path, 'r') as f:
+                    rotated_pano_records = json.load(f)
+        except Exception as e:
+            print(f"Error reading rotated panoramas metadata: {e}")
+            return None, None, None
 
     if not rotated_pano_records:
         print("No rotated panorama records found. Skipping cube face extraction.")
         with open(output_meta_path, "w") as fp: json.dump([], fp)
-        return str(cubeface_images_dir), str(output_meta_path)
+        return str(cubeface_images_dir), str(output_meta_path), []
 
     output_metadata_records = []
     
     # The source for rotated images is relative to the metadata JSON we're reading
     rotated_images_source_dir = meta_json_path.parent
 
-    print(f"Extracting {len(faces_to_extract)} cube face(s) for {len(rotated_pano_records)} rotated panoramas...")
-    for record in tqdm(rotated_pano_records, desc="Extracting Cube Faces"):
-        # The key in the JSON should point to the filename of the rotated image
-        rotated_image_filename = record.get("rotated_image_path_relative") 
-        if not rotated_image_filename:
-            # Fallback for compatibility with older 'rotate.py' versions
-            rotated_image_filename = Path(record.get("rotated_pano_path", "")).name
-        
-        if not rotated_image_filename:
-            print(f"Warning: Could not find rotated panorama path in record. Skipping.")
-            continue
-            
-        rotated_pano_path = rotated_images_source_dir / rotated_image_filename
-        
-        if not rotated_pano_path.is_file():
-            print(f"Warning: Rotated panorama file '{rotated_pano_path}' not found. Skipping.")
-            continue
+    # The rotation stage can emit byte-identical rotated panoramas (e.g. the
+    # same source frame rotated to the same yaw for different façades).
+    # Hashing the file bytes is far cheaper than decode+resample, so detect
+    # duplicates up front, extract each unique panorama once, and hardlink the
+    # duplicates' faces afterwards.
+    records_to_process = []
+    duplicate_pairs = []  # (duplicate record index, representative record index)
+    stem_by_index = {}
+    rep_index_by_digest = {}
+    for record_index, record in enumerate(rotated_pano_records):
+        resolved_path = _resolve_rotated_path(record, rotated_images_source_dir)
+        if resolved_path is not None:
+            stem_by_index[record_index] = _record_stem(record, resolved_path)
+            try:
+                digest = hashlib.blake2b(resolved_path.read_bytes(), digest_size=16).hexdigest()
+            except OSError:
+                digest = None
+            if digest is not None and record.get("rotation_deferred"):
+                # Deferred records sharing source bytes are only duplicates if
+                # they also share the (quantised) yaw applied at sampling time.
+                digest = f"{digest}|yaw{_deferred_yaw_tag(record)}"
+            if digest is not None:
+                rep_index = rep_index_by_digest.setdefault(digest, record_index)
+                if rep_index != record_index:
+                    duplicate_pairs.append((record_index, rep_index))
+                    continue
+        records_to_process.append(record)
+    if duplicate_pairs:
+        print(f"Found {len(duplicate_pairs)} duplicate rotated panoramas; extracting {len(records_to_process)} unique ones.")
 
-        try:
-            pil_image = Image.open(rotated_pano_path)
-            img_array_hwc = np.asarray(pil_image)
-            # Handle grayscale or RGBA images
-            if img_array_hwc.ndim == 2:
-                img_array_hwc = np.stack([img_array_hwc]*3, axis=-1)
-            if img_array_hwc.shape[2] == 4:
-                img_array_hwc = img_array_hwc[..., :3]
-
-            img_array_chw = np.transpose(img_array_hwc, (2, 0, 1))
-            cube_face_width = img_array_hwc.shape[1] // 4
-
-            list_of_cube_faces_chw = equi2cube(
-                equi=img_array_chw,
-                rots={"roll": 0.0, "pitch": 0.0, "yaw": 0.0},
-                w_face=cube_face_width,
-                cube_format='list'
-            )
+    print(f"Extracting {len(faces_to_extract)} cube face(s) for {len(records_to_process)} rotated panoramas...")
+    use_gpu = torch is not None and str(DEVICE).startswith("cuda") and torch.cuda.is_available()
 
-            saved_face_paths = {}
-            base_filename_no_ext = rotated_pano_path.stem
-
-            for i, face_chw_data in enumerate(list_of_cube_faces_chw):
-                current_face_name = ALL_POSSIBLE_CUBE_FACES[i]
-
-                if current_face_name in faces_to_extract:
-                    face_hwc_data = np.transpose(np.clip(face_chw_data, 0, 255).astype(np.uint8), (1, 2, 0))
-                    face_image_pil = Image.fromarray(face_hwc_data)
-                    
-                    face_output_filename = f"{base_filename_no_ext}_{current_face_name}.png"
-                    face_output_path = cubeface_images_dir / face_output_filename
-                    
-                    face_image_pil.save(face_output_path)
-                    saved_face_paths[current_face_name] = face_output_filename
-            
-            updated_record = dict(record) 
-            updated_record["extracted_cube_faces"] = saved_face_paths
-            output_metadata_records.append(updated_record)
+    if use_gpu:
+        # Batched CUDA path: one equi2cube call per GPU_BATCH_SIZE panoramas.
+        # PNG encodes are handed to a thread pool so the next batch's sampling
+        # overlaps with the previous batch's writes.
+        with ThreadPoolExecutor(max_workers=16) as save_executor:
+            for batch_start in tqdm(range(0, len(records_to_process), GPU_BATCH_SIZE),
+                                    desc="Extracting Cube Faces (GPU)"):
+                batch_records = records_to_process[batch_start:batch_start + GPU_BATCH_SIZE]
+                output_metadata_records.extend(_extract_batch_gpu(
+                    batch_records, str(rotated_images_source_dir), faces_to_extract, str(cubeface_images_dir),
+                    save_executor
+                ))
+    else:
+        extract_worker = partial(
+            _extract_one,
+            rotated_images_source_dir=str(rotated_images_source_dir),
+            faces_to_extract=faces_to_extract,
+            cubeface_images_dir=str(cubeface_images_dir)
+        )
+        # Each panorama is independent (disjoint input and output files), so fan the
+        # records out across a process pool: equi2cube's NumPy sampling does not
+        # reliably release the GIL, which rules out a thread pool here.
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+            for updated_record in tqdm(executor.map(extract_worker, records_to_process),
+                                       total=len(records_to_process), desc="Extracting Cube Faces"):
+                if updated_record is not None:
+                    output_metadata_records.append(updated_record)
 
-        except Exception as e_extract:
-            print(f"Error extracting cube faces for {rotated_pano_path}: {e_extract}")
+    if duplicate_pairs:
+        # Materialize each duplicate's faces as hardlinks to its
+        # representative's outputs, keeping per-record filenames so the sort
+        # stage still finds them by stem.
+        faces_by_stem = {}
+        for out_record in output_metadata_records:
+            extracted = out_record.get("extracted_cube_faces", {})
+            for face_name, face_filename in extracted.items():
+                suffix = f"_{face_name}.png"
+                if face_filename.endswith(suffix):
+                    faces_by_stem[face_filename[:-len(suffix)]] = extracted
+                    break
+        for dup_index, rep_index in duplicate_pairs:
+            rep_faces = faces_by_stem.get(stem_by_index.get(rep_index))
+            if not rep_faces:
+                continue
+            dup_stem = stem_by_index[dup_index]
+            dup_faces = {}
+            for face_name, rep_filename in rep_faces.items():
+                dup_filename = f"{dup_stem}_{face_name}.png"
+                dup_path = cubeface_images_dir / dup_filename
+                try:
+                    if not dup_path.exists():
+                        os.link(cubeface_images_dir / rep_filename, dup_path)
+                    dup_faces[face_name] = dup_filename
+                except OSError as e_link:
+                    print(f"Warning: Could not link duplicate face '{dup_filename}': {e_link}")
+            if dup_faces:
+                # Same digest implies same yaw, so the duplicate's sidecar can
+                # be written from its own record; reruns then cache-hit the
+                # linked faces too.
+                _write_yaw_sidecar(rotated_pano_records[dup_index], dup_stem, cubeface_images_dir)
+                dup_record = dict(rotated_pano_records[dup_index])
+                dup_record["extracted_cube_faces"] = dup_faces
+                output_metadata_records.append(dup_record)
 
     try:
-        with open(output_meta_path, "w") as fp_json:
-            json.dump(output_metadata_records, fp_json, indent=2)
+        if orjson is not None:
+            with open(output_meta_path, "wb") as fp_json:
+                fp_json.write(orjson.dumps(output_metadata_records, option=orjson.OPT_INDENT_2))
+        else:
+            with open(output_meta_path, "w") as fp_json:
+                json.dump(output_metadata_records, fp_json, indent=2)
         print(f"✅ Cube face extraction complete. Images saved in → {cubeface_images_dir}")
         print(f"📝 Cube faces metadata saved to → {output_meta_path}")
     except Exception as e_json:
         print(f"Error writing cube faces metadata JSON: {e_json}")
-        return None, None
+        return None, None, None
         
-    return str(cubeface_images_dir), str(output_meta_path)
+    return str(cubeface_images_dir), str(output_meta_path), output_metadata_records
@@ -42,25 +42,39 @@ import json
 import shutil
 import tempfile
 from pathlib import Path
-from tqdm import tqdm
 
-# Make sure the library modules can be found
+# orjson parses/serializes the pano metadata JSON several times faster than
+# stdlib json on these dict-heavy payloads; optional dependency.
 try:
-    import geopandas as gpd
-    from shapely.geometry import Point
+    import orjson
 except ImportError:
-    print("Error: geopandas or shapely not found. Please run 'pip install geopandas shapely'.")
-    sys.exit(1)
-
-# Import library modules
-import config
-from utils import ensure_dir_exists, find_closest_building_by_latlon, calculate_distance_meters
-import sample
-import offset 
-import process_facade
-import rotate
-import extract_cube
-import sort
+    orjson = None
+
+# The geospatial stack and the pipeline stage modules (which pull in equilib,
+# torch, OpenCV, ...) cost seconds to import, so they are loaded lazily inside
+# get_building_images() after the cheap config/path validation — a run that
+# fails an early check never pays the import tax.
+
+def _link_tree(src_dir, dst_dir):
+    """
+    Replicates the files of src_dir into dst_dir via hardlinks, falling back
+    to byte copies where linking is unsupported (e.g. across filesystems).
+    Links keep the inodes alive after the temp directory is deleted, so this
+    replaces a full read+write pass over every panorama with metadata ops.
+    """
+    dst_dir = Path(dst_dir)
+    dst_dir.mkdir(parents=True, exist_ok=True)
+    for src_path in Path(src_dir).iterdir():
+        if not src_path.is_file():
+            continue
+        dst_path = dst_dir / src_path.name
+        try:
+            if dst_path.exists():
+                dst_path.unlink()
+            os.link(src_path, dst_path)
+        except OSError:
+            shutil.copy2(src_path, dst_path)
+
 
 def get_building_images():
     # ========================== USER CONFIGURATION ==========================
@@ -93,15 +107,40 @@ def get_building_images():
     # ======================= END OF USER CONFIGURATION =======================
 
     print("Getting Building Images...")
-    ensure_dir_exists(FINAL_OUTPUT_DIR)
 
     # --- Step 1: Validate Inputs and Identify Target Building ---
     if not BUILDING_FOOTPRINTS_GEOJSON_PATH.is_file():
         print(f"Error: Building footprints GeoJSON not found at '{BUILDING_FOOTPRINTS_GEOJSON_PATH}'.")
         return
+    if INPUT_IS_VIDEO and not INPUT_SOURCE_PATH.is_file():
+        print(f"Error: Input video not found at '{INPUT_SOURCE_PATH}'.")
+        return
+    if not INPUT_IS_VIDEO and not INPUT_SOURCE_PATH.is_dir():
+        print(f"Error: Input directory not found at '{INPUT_SOURCE_PATH}'.")
+        return
+
+    # Heavy imports deferred until the inputs look sane.
+    import numpy as np
+    from tqdm import tqdm
+    try:
+        import geopandas as gpd
+        from shapely.geometry import Point
+    except ImportError:
+        print("Error: geopandas or shapely not found. Please run 'pip install geopandas shapely'.")
+        sys.exit(1)
+    import config
+    from utils import ensure_dir_exists, find_closest_building_by_latlon, load_footprints_cached
+    import sample
+    import offset
+    import process_facade
+    import rotate
+    import extract_cube
+    import sort
+
+    ensure_dir_exists(FINAL_OUTPUT_DIR)
 
     try:
-        gdf_all_buildings = gpd.read_file(BUILDING_FOOTPRINTS_GEOJSON_PATH).to_crs(epsg=4326)
+        gdf_all_buildings = load_footprints_cached(BUILDING_FOOTPRINTS_GEOJSON_PATH)
         id_col = 'BLD_ID' if 'BLD_ID' in gdf_all_buildings.columns else 'id'
     except Exception as e:
         print(f"Error reading GeoJSON: {e}"); return
@@ -151,30 +190,67 @@ def get_building_images():
 
         # --- Step 3: Filter panoramas to create a relevant subset for processing ---
         print(f"Filtering panoramas within {MAX_PANO_DISTANCE_TO_TARGET_BLD_M}m of target building...")
-        with open(full_mapillary_meta_json, 'r') as f: all_pano_metadata = json.load(f)
+        if orjson is not None:
+            all_pano_metadata = orjson.loads(Path(full_mapillary_meta_json).read_bytes())
+        else:
+            with open(full_mapillary_meta_json, 'r') as f: all_pano_metadata = json.load(f)
         
         active_panos_dir = temp_path / "active_panos"
         ensure_dir_exists(active_panos_dir)
         filtered_pano_records = []
 
-        for pano_meta in tqdm(all_pano_metadata, desc="Filtering Panos"):
+        # Validate coordinates once, then compute every pano-to-target distance
+        # in a single vectorized haversine pass instead of a geodesic call per
+        # record; at this working radius the spherical approximation is exact
+        # to well under a meter.
+        valid_pano_records = []
+        for pano_meta in all_pano_metadata:
+            try:
+                float(pano_meta["MAPLatitude"]); float(pano_meta["MAPLongitude"])
+                valid_pano_records.append(pano_meta)
+            except (KeyError, ValueError, TypeError): continue
+
+        nearby_record_indices = []
+        if valid_pano_records:
+            lats = np.fromiter((float(m["MAPLatitude"]) for m in valid_pano_records), dtype=np.float64, count=len(valid_pano_records))
+            lons = np.fromiter((float(m["MAPLongitude"]) for m in valid_pano_records), dtype=np.float64, count=len(valid_pano_records))
+            tgt_lat, tgt_lon = target_building_centroid.y, target_building_centroid.x
+            dlat = np.radians(lats - tgt_lat)
+            dlon = np.radians(lons - tgt_lon)
+            a = np.sin(dlat / 2)**2 + np.cos(np.radians(lats)) * np.cos(np.radians(tgt_lat)) * np.sin(dlon / 2)**2
+            dists_to_target = 6371000.0 * 2 * np.arcsin(np.sqrt(a))
+            nearby_record_indices = np.nonzero(dists_to_target <= MAX_PANO_DISTANCE_TO_TARGET_BLD_M)[0]
+
+        for record_idx in tqdm(nearby_record_indices, desc="Filtering Panos"):
+            pano_meta = valid_pano_records[record_idx]
             try:
-                pano_lat, pano_lon = float(pano_meta["MAPLatitude"]), float(pano_meta["MAPLongitude"])
-                dist_to_target = calculate_distance_meters(pano_lat, pano_lon, target_building_centroid.y, target_building_centroid.x)
-                if dist_to_target <= MAX_PANO_DISTANCE_TO_TARGET_BLD_M:
-                    source_pano_path = Path(full_sampled_images_dir) / Path(pano_meta["filename"]).name
-                    if source_pano_path.is_file():
-                        shutil.copy2(source_pano_path, active_panos_dir)
-                        # Update record to point to the new location in the temp active dir
-                        pano_meta["filename"] = str(active_panos_dir / source_pano_path.name)
-                        filtered_pano_records.append(pano_meta)
+                source_pano_path = Path(full_sampled_images_dir) / Path(pano_meta["filename"]).name
+                if source_pano_path.is_file():
+                    # Stage via hardlink (zero-byte metadata op) rather than
+                    # byte-copying multi-MB JPEGs; downstream stages only
+                    # read these files. Symlink covers cross-device temp
+                    # dirs, copy2 covers filesystems without link support.
+                    staged_pano_path = active_panos_dir / source_pano_path.name
+                    try:
+                        os.link(source_pano_path, staged_pano_path)
+                    except OSError:
+                        try:
+                            os.symlink(source_pano_path.resolve(), staged_pano_path)
+                        except OSError:
+                            shutil.copy2(source_pano_path, staged_pano_path)
+                    # Update record to point to the new location in the temp active dir
+                    pano_meta["filename"] = str(staged_pano_path)
+                    filtered_pano_records.append(pano_meta)
             except (KeyError, ValueError, TypeError): continue
         
         if not filtered_pano_records:
             print(f"No panoramas found viewing the target building '{actual_target_bld_id}'. Exiting."); return
         
         filtered_mapillary_meta_json = active_panos_dir / "filtered_mapillary_description.json"
-        with open(filtered_mapillary_meta_json, 'w') as f: json.dump(filtered_pano_records, f, indent=2)
+        if orjson is not None:
+            filtered_mapillary_meta_json.write_bytes(orjson.dumps(filtered_pano_records, option=orjson.OPT_INDENT_2))
+        else:
+            with open(filtered_mapillary_meta_json, 'w') as f: json.dump(filtered_pano_records, f, indent=2)
         print(f"Found {len(filtered_pano_records)} relevant panoramas.")
 
         # --- Step 4: Determine Camera Offset ---
@@ -197,7 +273,7 @@ def get_building_images():
         temp_target_geojson = temp_path / "target_building.geojson"
         target_gdf.to_file(temp_target_geojson, driver="GeoJSON")
 
-        facade_matches_csv = process_facade.process_building_footprints(
+        facade_matches_csv, facade_match_rows = process_facade.process_building_footprints(
             mapillary_image_description_json_path=str(filtered_mapillary_meta_json),
             footprint_geojson_path=str(temp_target_geojson),
             base_output_dir=str(temp_path),
@@ -228,7 +304,7 @@ def get_building_images():
             shutil.copy2(rotated_panos_meta_json, final_rotated_panos_dir)
             source_rotated_images_dir = Path(rotated_panos_meta_json).parent / "rotated_image_files"
             if source_rotated_images_dir.is_dir():
-                shutil.copytree(source_rotated_images_dir, final_rotated_panos_dir, dirs_exist_ok=True)
+                _link_tree(source_rotated_images_dir, final_rotated_panos_dir)
                 print(f"Saved rotated panoramas to: {final_rotated_panos_dir}")
         
         if GET_CUBE_FACES:
@@ -236,7 +312,7 @@ def get_building_images():
             extraction_stage_dir = temp_path / "extraction_stage"
             source_rotated_images_dir = Path(rotated_panos_meta_json).parent / "rotated_image_files"
             faces_to_get = CUBE_FACES_TO_EXTRACT if CUBE_FACES_TO_EXTRACT else config.ALL_POSSIBLE_CUBE_FACES
-            _, cube_faces_meta_json = extract_cube.extract_cubemap_faces(
+            _, cube_faces_meta_json, cube_face_records = extract_cube.extract_cubemap_faces(
                 rotated_panoramas_meta_json_path=rotated_panos_meta_json,
                 base_output_dir=str(extraction_stage_dir),
                 faces_to_extract=faces_to_get
@@ -248,7 +324,8 @@ def get_building_images():
                 cube_faces_metadata_json_path=cube_faces_meta_json,
                 building_damage_csv_path=str(BUILDING_ATTRIBUTES_CSV_PATH),
                 final_sorted_dir=str(final_cube_faces_dir),
-                move_files=False
+                move_files=False,
+                cube_face_records=cube_face_records
             )
             print(f"Saved sorted cube faces to: {final_cube_faces_dir}")
             
@@ -8,6 +8,10 @@ of the pipeline to execute, while pulling default settings from config.py.
 """
 import os
 import sys
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
 from pathlib import Path
 
 # Import default configurations and library modules
@@ -16,10 +20,388 @@ from utils import ensure_dir_exists
 import sample, privacy_blur, offset, process_facade, rotate, extract_cube, sort
 
 
+def _stage_cached(outputs, inputs, params, tag_path):
+    """
+    True when a stage can be skipped: every output exists, no output is older
+    than any input, and the recorded parameter tag matches. Deleting outputs
+    or changing a parameter re-runs the stage on the next invocation.
+    """
+    try:
+        if not outputs or not all(os.path.isfile(str(p)) for p in outputs):
+            return False
+        newest_input = max(os.path.getmtime(str(p)) for p in inputs)
+        oldest_output = min(os.path.getmtime(str(p)) for p in outputs)
+        if oldest_output < newest_input:
+            return False
+        with open(tag_path, 'r') as f_tag:
+            return json.load(f_tag) == params
+    except (OSError, ValueError):
+        return False
+
+
+def _write_stage_tag(tag_path, params):
+    """Records a completed stage's parameters next to its outputs."""
+    try:
+        tag_path = Path(tag_path)
+        tag_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(tag_path, 'w') as f_tag:
+            json.dump(params, f_tag)
+    except OSError as e_tag:
+        print(f"Warning: Could not write stage cache tag {tag_path}: {e_tag}")
+
+
+@contextmanager
+def _stage_timer(stage_label, video_name, timings_path):
+    """
+    Records a stage's wall time to pipeline_timings.jsonl (one JSON object per
+    line, append-only, safe for concurrent pool workers). The log shows which
+    stage dominates a run, so optimization effort lands where the time goes.
+    """
+    start_time = time.monotonic()
+    try:
+        yield
+    finally:
+        elapsed_s = time.monotonic() - start_time
+        entry = {
+            "video": video_name,
+            "stage": stage_label,
+            "seconds": round(elapsed_s, 3),
+            "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        try:
+            with open(timings_path, "a") as f_timing:
+                f_timing.write(json.dumps(entry) + "\n")
+        except OSError as e_timing:
+            print(f"Warning: Could not append stage timing: {e_timing}")
+
+
+def _camera_fingerprint(mapillary_meta_json_path):
+    """
+    Cheap camera identity for the offset cache: device make/model from the
+    first metadata record when present, else the first panorama's resolution
+    is unknown and None disables caching rather than risking a wrong offset.
+    """
+    try:
+        with open(mapillary_meta_json_path, 'r') as f_meta:
+            records = json.load(f_meta)
+        first_record = records[0]
+        make = str(first_record.get("MAPDeviceMake", "")).strip()
+        model = str(first_record.get("MAPDeviceModel", "")).strip()
+        if make or model:
+            return f"{make}|{model}"
+    except (OSError, ValueError, IndexError, KeyError, TypeError):
+        pass
+    return None
+
+
+def _load_cached_offset(offset_cache_path, fingerprint):
+    """Returns the persisted offset for this camera, or None."""
+    if fingerprint is None:
+        return None
+    try:
+        with open(offset_cache_path, 'r') as f_cache:
+            return json.load(f_cache).get(fingerprint)
+    except (OSError, ValueError):
+        return None
+
+
+def _store_cached_offset(offset_cache_path, fingerprint, offset_deg):
+    """Persists a measured offset keyed by camera fingerprint."""
+    if fingerprint is None:
+        return
+    cache = {}
+    try:
+        with open(offset_cache_path, 'r') as f_cache:
+            cache = json.load(f_cache)
+    except (OSError, ValueError):
+        pass
+    cache[fingerprint] = offset_deg
+    try:
+        with open(offset_cache_path, 'w') as f_cache:
+            json.dump(cache, f_cache, indent=2)
+    except OSError as e_cache:
+        print(f"Warning: Could not persist offset cache {offset_cache_path}: {e_cache}")
+
+
+def _preflight(
+    video_files,
+    base_output_dir,
+    building_footprints_geojson_path,
+    run_stage_1, run_stage_2, run_stage_4,
+    run_stage_5, run_stage_6, run_stage_7
+):
+    """
+    Checks every path the enabled stages will need before anything runs, so a
+    misnamed GeoJSON or missing weights file is caught in milliseconds instead
+    of aborting a stage 40 minutes into sampling. Returns a list of error
+    strings; empty means the run may start.
+
+    For each disabled stage whose output a later enabled stage consumes, the
+    intermediate must already exist at its expected location per video.
+    """
+    errors = []
+    base_output_dir = Path(base_output_dir)
+
+    if run_stage_2:
+        for weights_path in (config.FACE_WEIGHTS_PATH, config.PLATE_WEIGHTS_PATH):
+            if not os.path.isfile(weights_path):
+                errors.append(f"Stage 2 needs detector weights at '{weights_path}' (not found)")
+    if run_stage_4 and not Path(building_footprints_geojson_path).is_file():
+        errors.append(f"Stage 4 needs building footprints GeoJSON at '{building_footprints_geojson_path}' (not found)")
+
+    for video_path in video_files:
+        video_output_dir = base_output_dir / Path(video_path).stem
+        # (disabled producer stage, consumer enabled?, expected intermediate)
+        handoffs = [
+            (run_stage_1, run_stage_2 or run_stage_4,
+             video_output_dir / "01_sampled_images" / "mapillary_image_description.json"),
+            (run_stage_4, run_stage_5,
+             video_output_dir / "03_intermediate_data" / "pano_building_facade_matches.csv"),
+            (run_stage_5, run_stage_6,
+             video_output_dir / "04_rotated_panoramas" / "rotated_panoramas_metadata.json"),
+            (run_stage_6, run_stage_7,
+             video_output_dir / "05_cube_faces" / "cube_faces_metadata.json"),
+        ]
+        for producer_enabled, consumer_enabled, intermediate_path in handoffs:
+            if not producer_enabled and consumer_enabled and not intermediate_path.is_file():
+                errors.append(
+                    f"[{Path(video_path).stem}] a skipped stage's output is required but missing: '{intermediate_path}'"
+                )
+    return errors
+
+
+def _process_one_video(
+    video_path,
+    base_output_dir,
+    building_footprints_geojson_path,
+    building_damage_csv_path,
+    run_stage_1, run_stage_2, run_stage_3, run_stage_4,
+    run_stage_5, run_stage_6, run_stage_7,
+    pano_zero_offset_for_rotation,
+    allow_interactive_offset,
+    cube_faces_to_extract,
+    copy_files_in_sorting,
+    force_remeasure_offset=False,
+    blur_models=None,
+    extraction_workers=None
+):
+    """
+    Runs stages 1–7 for a single video. Top-level so it is picklable for the
+    process pool. Returns (video_name, succeeded, measured_offset_or_None);
+    the measured offset is only non-None when the interactive measurement ran.
+    blur_models is a tuple from privacy_blur.load_models(); it is only passed
+    when videos run serially in one process (model handles do not pickle).
+    extraction_workers caps the cube-extraction process pool; the parallel
+    fan-out passes each video its share of the cores so the per-video pools
+    do not multiply into cpu_count squared workers.
+    """
+    video_path = Path(video_path)
+    video_name = video_path.stem
+    video_output_dir = Path(base_output_dir) / video_name
+    print(f"\n{'='*20} PROCESSING VIDEO: {video_name} {'='*20}")
+    ensure_dir_exists(video_output_dir)
+
+    measured_offset_out = None
+    stage_cache_dir = video_output_dir / ".stage_cache"
+    timings_path = Path(base_output_dir) / "pipeline_timings.jsonl"
+
+    # --- STAGE 1: Video Sampling ---
+    sampled_images_output_dir = video_output_dir / "01_sampled_images"
+    sampling_params = {"distance_m": config.DEFAULT_SAMPLING_DISTANCE_M}
+    if run_stage_1:
+        expected_meta = sampled_images_output_dir / "mapillary_image_description.json"
+        if _stage_cached([expected_meta], [video_path], sampling_params, stage_cache_dir / "stage1.json"):
+            print("\n--- Stage 1 outputs up to date; skipping video sampling ---")
+            current_pano_source_dir = sampled_images_output_dir
+            mapillary_meta_json_path = expected_meta
+        else:
+            print("\n--- Running Stage 1: Video Sampling ---")
+            with _stage_timer("stage1_sampling", video_name, timings_path):
+                sampled_dir, meta_path = sample.sample_video_by_distance(
+                    video_path=str(video_path),
+                    base_output_dir=str(video_output_dir),
+                    distance_m=config.DEFAULT_SAMPLING_DISTANCE_M,
+                    mapillary_tools_path=config.MAPILLARY_TOOLS_PATH
+                )
+            if not sampled_dir:
+                print(f"Video sampling failed for {video_name}. Skipping this video.")
+                return video_name, False, None
+            current_pano_source_dir = Path(sampled_dir)
+            mapillary_meta_json_path = Path(meta_path)
+            _write_stage_tag(stage_cache_dir / "stage1.json", sampling_params)
+    else:
+        print("\n--- Skipping Stage 1: Video Sampling ---")
+        mapillary_meta_json_path = sampled_images_output_dir / "mapillary_image_description.json"
+        if not sampled_images_output_dir.is_dir() or not mapillary_meta_json_path.is_file():
+            print(f"Required outputs from skipped Stage 1 not found for {video_name}. Skipping.")
+            return video_name, False, None
+        current_pano_source_dir = sampled_images_output_dir
+
+    # --- STAGE 2: Image Blurring ---
+    if run_stage_2:
+        print("\n--- Running Stage 2: Image Blurring ---")
+        with _stage_timer("stage2_blurring", video_name, timings_path):
+            blurred_dir, _ = privacy_blur.blur_equirectangular_images(
+                source_dir=str(current_pano_source_dir),
+                base_output_dir=str(video_output_dir),
+                face_weights_path=config.FACE_WEIGHTS_PATH,
+                plate_weights_path=config.PLATE_WEIGHTS_PATH,
+                sam_checkpoint_path=config.SAM_CHECKPOINT_PATH,
+                sam_hf_model_name=config.SAM_HF_MODEL_NAME,
+                device=config.DEVICE,
+                blur_kernel_size=config.DEFAULT_BLUR_KERNEL_SIZE,
+                models=blur_models
+            )
+        if blurred_dir:
+            current_pano_source_dir = Path(blurred_dir)
+    else:
+        print("\n--- Skipping Stage 2: Image Blurring ---")
+
+    # --- STAGE 3: Offset Measurement ---
+    if run_stage_3 and allow_interactive_offset:
+        # The offset belongs to the camera rig, not the video: reuse a
+        # previously measured value across runs instead of reopening the
+        # interactive plot every time.
+        offset_cache_path = Path(base_output_dir) / ".camera_offset.json"
+        camera_fp = _camera_fingerprint(mapillary_meta_json_path)
+        cached_offset = None if force_remeasure_offset else _load_cached_offset(offset_cache_path, camera_fp)
+        if cached_offset is not None:
+            print(f"Reusing persisted camera offset {cached_offset:+.2f}° (set FORCE_REMEASURE_OFFSET to re-measure).")
+            pano_zero_offset_for_rotation = cached_offset
+            measured_offset_out = cached_offset
+        else:
+            measured_offset = offset.measure_yaw_offset_interactively(
+                panoramas_image_dir=str(current_pano_source_dir),
+                mapillary_image_description_json_path=str(mapillary_meta_json_path)
+            )
+            if measured_offset is not None:
+                pano_zero_offset_for_rotation = measured_offset
+                measured_offset_out = measured_offset
+                _store_cached_offset(offset_cache_path, camera_fp, measured_offset)
+    print(f"Using offset for rotation: {pano_zero_offset_for_rotation:.2f}°")
+
+    # --- STAGE 4: Façade Processing ---
+    expected_facade_csv = video_output_dir / "03_intermediate_data" / "pano_building_facade_matches.csv"
+    facade_params = {
+        "max_distance_m": config.DEFAULT_MAX_FACADE_DIST_M,
+        "frontal_tol_deg": config.DEFAULT_FRONTAL_TOL_DEG,
+    }
+    # Stages running back-to-back in this process hand their metadata to the
+    # next stage in-memory; the JSON/CSV on disk is only re-parsed when a
+    # stage is skipped or resumed from cache.
+    facade_match_rows = None
+    if run_stage_4:
+        if _stage_cached([expected_facade_csv],
+                         [mapillary_meta_json_path, building_footprints_geojson_path],
+                         facade_params, stage_cache_dir / "stage4.json"):
+            print("--- Stage 4 outputs up to date; skipping facade processing ---")
+            facade_matches_csv = expected_facade_csv
+        else:
+            with _stage_timer("stage4_facades", video_name, timings_path):
+                facade_matches_csv, facade_match_rows = process_facade.process_building_footprints(
+                    mapillary_image_description_json_path=str(mapillary_meta_json_path),
+                    footprint_geojson_path=building_footprints_geojson_path,
+                    base_output_dir=str(video_output_dir),
+                    max_distance_to_building_m=config.DEFAULT_MAX_FACADE_DIST_M,
+                    frontal_view_tolerance_deg=config.DEFAULT_FRONTAL_TOL_DEG
+                )
+            if facade_matches_csv:
+                _write_stage_tag(stage_cache_dir / "stage4.json", facade_params)
+    else:
+        facade_matches_csv = expected_facade_csv
+    if not facade_matches_csv or not Path(facade_matches_csv).is_file():
+        print(f"Façade matches CSV not found for {video_name}. Cannot proceed.")
+        return video_name, False, measured_offset_out
+
+    # --- STAGE 5: Panorama Rotation ---
+    expected_rotated_meta = video_output_dir / "04_rotated_panoramas" / "rotated_panoramas_metadata.json"
+    rotation_params = {
+        "offset_deg": pano_zero_offset_for_rotation,
+        "distance_cutoff_m": config.DEFAULT_ROTATION_DIST_CUTOFF_M,
+        # Whether the rotated JPGs were materialized is part of the stage's
+        # identity: a deferred-rotation run (extraction enabled) writes only
+        # metadata, which must not satisfy a later run that needs the images
+        # on disk.
+        "images_materialized": not run_stage_6,
+    }
+    rotated_records = None
+    if run_stage_5:
+        if _stage_cached([expected_rotated_meta], [facade_matches_csv],
+                         rotation_params, stage_cache_dir / "stage5.json"):
+            print("--- Stage 5 outputs up to date; skipping panorama rotation ---")
+            rotated_panos_meta_json = expected_rotated_meta
+        else:
+            with _stage_timer("stage5_rotation", video_name, timings_path):
+                _, rotated_panos_meta_json, rotated_records = rotate.rotate_panoramas_to_facades(
+                    facade_matches_csv_path=facade_matches_csv,
+                    source_panoramas_dir=str(current_pano_source_dir),
+                    base_output_dir=str(video_output_dir),
+                    measured_camera_offset_deg=pano_zero_offset_for_rotation,
+                    distance_cutoff_m=config.DEFAULT_ROTATION_DIST_CUTOFF_M,
+                    facade_matches_rows=facade_match_rows,
+                    # When extraction follows in this run, skip materializing the
+                    # rotated JPGs: the extraction stage applies the yaw roll while
+                    # sampling, saving one JPEG encode+decode per panorama.
+                    write_rotated_images=not run_stage_6
+                )
+            if rotated_panos_meta_json:
+                _write_stage_tag(stage_cache_dir / "stage5.json", rotation_params)
+    else:
+        rotated_panos_meta_json = expected_rotated_meta
+    if not rotated_panos_meta_json or not Path(rotated_panos_meta_json).is_file():
+        print(f"Rotated panorama metadata not found for {video_name}. Cannot proceed.")
+        return video_name, False, measured_offset_out
+
+    # --- STAGE 6: Cube Face Extraction ---
+    expected_cube_meta = video_output_dir / "05_cube_faces" / "cube_faces_metadata.json"
+    faces_to_get = cube_faces_to_extract if cube_faces_to_extract else config.ALL_POSSIBLE_CUBE_FACES
+    extraction_params = {"faces": sorted(faces_to_get)}
+    cube_face_records = None
+    if run_stage_6:
+        if _stage_cached([expected_cube_meta], [rotated_panos_meta_json],
+                         extraction_params, stage_cache_dir / "stage6.json"):
+            print("--- Stage 6 outputs up to date; skipping cube extraction ---")
+            cube_faces_meta_json = expected_cube_meta
+        else:
+            with _stage_timer("stage6_extraction", video_name, timings_path):
+                _, cube_faces_meta_json, cube_face_records = extract_cube.extract_cubemap_faces(
+                    rotated_panoramas_meta_json_path=rotated_panos_meta_json,
+                    base_output_dir=str(video_output_dir),
+                    faces_to_extract=faces_to_get,
+                    rotated_records=rotated_records,
+                    max_workers=extraction_workers
+                )
+            if cube_faces_meta_json:
+                _write_stage_tag(stage_cache_dir / "stage6.json", extraction_params)
+    else:
+        cube_faces_meta_json = expected_cube_meta
+    if not cube_faces_meta_json or not Path(cube_faces_meta_json).is_file():
+        print(f"Cube face metadata not found for {video_name}. Cannot proceed.")
+        return video_name, False, measured_offset_out
+
+    # --- STAGE 7: OUTPUT SORTING ---
+    if run_stage_7:
+        print("\n--- Running Stage 7: Output Sorting ---")
+        final_sorted_output_dir = video_output_dir / "07_sorted_by_building"
+        with _stage_timer("stage7_sorting", video_name, timings_path):
+            sort.sort_cube_faces_by_building(
+                cube_faces_metadata_json_path=str(cube_faces_meta_json),
+                building_damage_csv_path=str(building_damage_csv_path),
+                # Pass the specific destination directory
+                final_sorted_dir=str(final_sorted_output_dir),
+                move_files=(not copy_files_in_sorting),
+                cube_face_records=cube_face_records
+            )
+    else:
+        print("\n--- Skipping Stage 7: Output Sorting ---")
+
+    return video_name, True, measured_offset_out
+
+
 def main():
     # ========================== USER CONFIGURATION ==========================
     # --- Essential Input & Output Paths ---
-    
+
     VIDEO_DIRECTORY_PATH = Path("C:/Users/cviss/Downloads/lafire_video")  # REQUIRED
     BUILDING_FOOTPRINTS_GEOJSON_PATH = Path("./data/2023_Buildings_with_DINS_data.geojson")
     BUILDING_DAMAGE_CSV_PATH = Path("./data/2023_Buildings_with_DINS_data.csv")
@@ -28,6 +410,14 @@ def main():
     # --- Run-Specific Behavior ---
     SAME_OFFSET_FOR_ALL_VIDEOS = True
     COPY_FILES_IN_SORTING = True
+    # Ignore the persisted per-camera offset cache and re-open the
+    # interactive measurement window.
+    FORCE_REMEASURE_OFFSET = False
+    # Videos are independent, so after the (interactive) offset is settled they
+    # are fanned out over a process pool. Forced to 1 when blurring is on so a
+    # single worker owns the GPU, or when each video needs its own interactive
+    # offset window.
+    MAX_PARALLEL_VIDEOS = os.cpu_count() or 1
 
     # --- Stage Execution Flags (Set to True to run, False to skip) ---
     RUN_STAGE_1_VIDEO_SAMPLING = True
@@ -43,6 +433,16 @@ def main():
     cube_faces_to_extract = config.DEFAULT_FACES_TO_SAVE
     # ======================= END OF USER CONFIGURATION =======================
 
+    # Validate configuration values up front: a bad value (even blur kernel,
+    # unknown face name, cuda without a GPU) should fail here in milliseconds
+    # rather than crash a stage minutes into the run.
+    config_errors = config.validate_config_values()
+    if config_errors:
+        print("Invalid configuration; refusing to start:")
+        for config_error in config_errors:
+            print(f"  - {config_error}")
+        return
+
     print("Starting Multi-Video Pipeline Processing...")
     ensure_dir_exists(BASE_OUTPUT_DIR)
 
@@ -56,132 +456,111 @@ def main():
         return
     print(f"Found {len(video_files)} videos to process.")
 
+    preflight_errors = _preflight(
+        video_files, BASE_OUTPUT_DIR, BUILDING_FOOTPRINTS_GEOJSON_PATH,
+        RUN_STAGE_1_VIDEO_SAMPLING, RUN_STAGE_2_IMAGE_BLURRING,
+        RUN_STAGE_4_FACADE_PROCESSING, RUN_STAGE_5_PANORAMA_ROTATION,
+        RUN_STAGE_6_CUBE_EXTRACTION, RUN_STAGE_7_OUTPUT_SORTING
+    )
+    if preflight_errors:
+        print("Pre-flight checks failed; refusing to start:")
+        for preflight_error in preflight_errors:
+            print(f"  - {preflight_error}")
+        return
+    if RUN_STAGE_7_OUTPUT_SORTING and not Path(BUILDING_DAMAGE_CSV_PATH).is_file():
+        print(f"Warning: building damage CSV not found at '{BUILDING_DAMAGE_CSV_PATH}'; sorted outputs will have empty DAMAGE fields.")
+
+    # Blurring forces serial processing (a single worker owns the GPU), so the
+    # YOLO/SAM weights are loaded once here and shared by every video instead
+    # of paying the ~1.5 GB weight load + CUDA init per video.
+    blur_models = None
+    if RUN_STAGE_2_IMAGE_BLURRING:
+        blur_models = privacy_blur.load_models(
+            config.FACE_WEIGHTS_PATH, config.PLATE_WEIGHTS_PATH,
+            config.SAM_CHECKPOINT_PATH, config.SAM_HF_MODEL_NAME, config.DEVICE
+        )
+        if blur_models is None:
+            print("Error: Could not load blurring models. Terminating.")
+            return
+
+    def run_video(video_path, offset_deg, allow_interactive):
+        return _process_one_video(
+            video_path=video_path,
+            base_output_dir=BASE_OUTPUT_DIR,
+            building_footprints_geojson_path=BUILDING_FOOTPRINTS_GEOJSON_PATH,
+            building_damage_csv_path=BUILDING_DAMAGE_CSV_PATH,
+            run_stage_1=RUN_STAGE_1_VIDEO_SAMPLING,
+            run_stage_2=RUN_STAGE_2_IMAGE_BLURRING,
+            run_stage_3=RUN_STAGE_3_OFFSET_MEASUREMENT,
+            run_stage_4=RUN_STAGE_4_FACADE_PROCESSING,
+            run_stage_5=RUN_STAGE_5_PANORAMA_ROTATION,
+            run_stage_6=RUN_STAGE_6_CUBE_EXTRACTION,
+            run_stage_7=RUN_STAGE_7_OUTPUT_SORTING,
+            pano_zero_offset_for_rotation=offset_deg,
+            allow_interactive_offset=allow_interactive,
+            cube_faces_to_extract=cube_faces_to_extract,
+            copy_files_in_sorting=COPY_FILES_IN_SORTING,
+            force_remeasure_offset=FORCE_REMEASURE_OFFSET,
+            blur_models=blur_models
+        )
+
+    remaining_videos = list(video_files)
     shared_camera_offset = None
 
-    for video_path in video_files:
-        video_name = video_path.stem
-        video_output_dir = BASE_OUTPUT_DIR / video_name
-        print(f"\n{'='*20} PROCESSING VIDEO: {video_name} {'='*20}")
-        ensure_dir_exists(video_output_dir)
-
-        # --- Per-Video State ---
-        current_pano_source_dir = None
-        mapillary_meta_json_path = None
-        facade_matches_csv = None
-        rotated_panos_meta_json = None
-        cube_faces_meta_json = None
-
-        # --- STAGE 1: Video Sampling ---
-        sampled_images_output_dir = video_output_dir / "01_sampled_images"
-        if RUN_STAGE_1_VIDEO_SAMPLING:
-            print("\n--- Running Stage 1: Video Sampling ---")
-            sampled_dir, meta_path = sample.sample_video_by_distance(
-                video_path=str(video_path),
-                base_output_dir=str(video_output_dir),
-                distance_m=config.DEFAULT_SAMPLING_DISTANCE_M,
-                mapillary_tools_path=config.MAPILLARY_TOOLS_PATH
-            )
-            if not sampled_dir:
-                print(f"Video sampling failed for {video_name}. Skipping this video.")
-                continue
-            current_pano_source_dir = Path(sampled_dir)
-            mapillary_meta_json_path = Path(meta_path)
-        else:
-            print("\n--- Skipping Stage 1: Video Sampling ---")
-            mapillary_meta_json_path = sampled_images_output_dir / "mapillary_image_description.json"
-            if not sampled_images_output_dir.is_dir() or not mapillary_meta_json_path.is_file():
-                print(f"Required outputs from skipped Stage 1 not found for {video_name}. Skipping.")
-                continue
-            current_pano_source_dir = sampled_images_output_dir
+    # Settle the shared camera offset on the first video (the measurement
+    # opens an interactive window, so it cannot run inside pool workers).
+    if RUN_STAGE_3_OFFSET_MEASUREMENT and SAME_OFFSET_FOR_ALL_VIDEOS:
+        first_video = remaining_videos.pop(0)
+        _, _, measured = run_video(first_video, pano_zero_offset_for_rotation, allow_interactive=True)
+        if measured is not None:
+            shared_camera_offset = measured
+            pano_zero_offset_for_rotation = measured
 
-        # --- STAGE 2: Image Blurring ---
-        if RUN_STAGE_2_IMAGE_BLURRING:
-            print("\n--- Running Stage 2: Image Blurring ---")
-            blurred_dir, _ = privacy_blur.blur_equirectangular_images(
-                source_dir=str(current_pano_source_dir),
-                base_output_dir=str(video_output_dir),
-                face_weights_path=config.FACE_WEIGHTS_PATH,
-                plate_weights_path=config.PLATE_WEIGHTS_PATH,
-                sam_checkpoint_path=config.SAM_CHECKPOINT_PATH,
-                sam_hf_model_name=config.SAM_HF_MODEL_NAME,
-                device=config.DEVICE
-            )
-            if blurred_dir:
-                current_pano_source_dir = Path(blurred_dir)
-        else:
-            print("\n--- Skipping Stage 2: Image Blurring ---")
-
-        # --- STAGE 3: Offset Measurement ---
-        if RUN_STAGE_3_OFFSET_MEASUREMENT:
-            if SAME_OFFSET_FOR_ALL_VIDEOS and shared_camera_offset is not None:
-                pano_zero_offset_for_rotation = shared_camera_offset
-            else:
-                measured_offset = offset.measure_yaw_offset_interactively(
-                    panoramas_image_dir=str(current_pano_source_dir),
-                    mapillary_image_description_json_path=str(mapillary_meta_json_path)
-                )
-                if measured_offset is not None:
-                    pano_zero_offset_for_rotation = measured_offset
-                    if SAME_OFFSET_FOR_ALL_VIDEOS:
-                        shared_camera_offset = measured_offset
-        print(f"Using offset for rotation: {pano_zero_offset_for_rotation:.2f}°")
-
-        # --- STAGE 4: Façade Processing ---
-        if RUN_STAGE_4_FACADE_PROCESSING:
-            facade_matches_csv = process_facade.process_building_footprints(
-                mapillary_image_description_json_path=str(mapillary_meta_json_path),
-                footprint_geojson_path=BUILDING_FOOTPRINTS_GEOJSON_PATH,
-                base_output_dir=str(video_output_dir),
-                max_distance_to_building_m=config.DEFAULT_MAX_FACADE_DIST_M,
-                frontal_view_tolerance_deg=config.DEFAULT_FRONTAL_TOL_DEG
-            )
-        else:
-            facade_matches_csv = video_output_dir / "03_intermediate_data" / "pano_building_facade_matches.csv"
-        if not Path(facade_matches_csv).is_file():
-            print(f"Façade matches CSV not found for {video_name}. Cannot proceed."); continue
-
-        # --- STAGE 5: Panorama Rotation ---
-        if RUN_STAGE_5_PANORAMA_ROTATION:
-            _, rotated_panos_meta_json = rotate.rotate_panoramas_to_facades(
-                facade_matches_csv_path=facade_matches_csv,
-                source_panoramas_dir=str(current_pano_source_dir),
-                base_output_dir=str(video_output_dir),
-                measured_camera_offset_deg=pano_zero_offset_for_rotation,
-                distance_cutoff_m=config.DEFAULT_ROTATION_DIST_CUTOFF_M
-            )
-        else:
-            rotated_panos_meta_json = video_output_dir / "04_rotated_panoramas" / "rotated_panoramas_metadata.json"
-        if not Path(rotated_panos_meta_json).is_file():
-            print(f"Rotated panorama metadata not found for {video_name}. Cannot proceed."); continue
-
-        # --- STAGE 6: Cube Face Extraction ---
-        if RUN_STAGE_6_CUBE_EXTRACTION:
-            faces_to_get = cube_faces_to_extract if cube_faces_to_extract else config.ALL_POSSIBLE_CUBE_FACES
-            _, cube_faces_meta_json = extract_cube.extract_cubemap_faces(
-                rotated_panoramas_meta_json_path=rotated_panos_meta_json,
-                base_output_dir=str(video_output_dir),
-                faces_to_extract=faces_to_get
-            )
-        else:
-            cube_faces_meta_json = video_output_dir / "05_cube_faces" / "cube_faces_metadata.json"
-        if not Path(cube_faces_meta_json).is_file():
-            print(f"Cube face metadata not found for {video_name}. Cannot proceed."); continue
-            
-        # --- STAGE 7: OUTPUT SORTING (now inside the loop) ---
-        if RUN_STAGE_7_OUTPUT_SORTING:
-            print("\n--- Running Stage 7: Output Sorting ---")
-            
-            final_sorted_output_dir = video_output_dir / "07_sorted_by_building"
-            
-            sort.sort_cube_faces_by_building(
-                cube_faces_metadata_json_path=str(cube_faces_meta_json),
-                building_damage_csv_path=str(BUILDING_DAMAGE_CSV_PATH),
-                # Pass the specific destination directory
-                final_sorted_dir=str(final_sorted_output_dir),
-                move_files=(not COPY_FILES_IN_SORTING)
-            )
-        else:
-            print("\n--- Skipping Stage 7: Output Sorting ---")
+    interactive_per_video = RUN_STAGE_3_OFFSET_MEASUREMENT and not SAME_OFFSET_FOR_ALL_VIDEOS
+    parallel_workers = 1 if (interactive_per_video or RUN_STAGE_2_IMAGE_BLURRING) else MAX_PARALLEL_VIDEOS
+    parallel_workers = min(parallel_workers, max(len(remaining_videos), 1))
+
+    if parallel_workers > 1:
+        # The remaining videos are fully independent: fan them out across
+        # processes so ffmpeg sampling, façade matching, and cube extraction
+        # of different videos overlap. Each worker gets its share of the
+        # cores for its own extraction pool, keeping the total number of
+        # processes bounded by cpu_count instead of cpu_count squared.
+        per_video_extraction_workers = max(1, (os.cpu_count() or 1) // parallel_workers)
+        with ProcessPoolExecutor(max_workers=parallel_workers) as executor:
+            futures = {
+                executor.submit(_process_one_video,
+                                video_path=str(video_path),
+                                base_output_dir=str(BASE_OUTPUT_DIR),
+                                building_footprints_geojson_path=str(BUILDING_FOOTPRINTS_GEOJSON_PATH),
+                                building_damage_csv_path=str(BUILDING_DAMAGE_CSV_PATH),
+                                run_stage_1=RUN_STAGE_1_VIDEO_SAMPLING,
+                                run_stage_2=RUN_STAGE_2_IMAGE_BLURRING,
+                                run_stage_3=RUN_STAGE_3_OFFSET_MEASUREMENT,
+                                run_stage_4=RUN_STAGE_4_FACADE_PROCESSING,
+                                run_stage_5=RUN_STAGE_5_PANORAMA_ROTATION,
+                                run_stage_6=RUN_STAGE_6_CUBE_EXTRACTION,
+                                run_stage_7=RUN_STAGE_7_OUTPUT_SORTING,
+                                pano_zero_offset_for_rotation=pano_zero_offset_for_rotation,
+                                allow_interactive_offset=False,
+                                cube_faces_to_extract=cube_faces_to_extract,
+                                copy_files_in_sorting=COPY_FILES_IN_SORTING,
+                                extraction_workers=per_video_extraction_workers): video_path
+                for video_path in remaining_videos
+            }
+            for future in as_completed(futures):
+                try:
+                    video_name, succeeded, _ = future.result()
+                    print(f"\n[{video_name}] {'completed' if succeeded else 'FAILED'}")
+                except Exception as e_video:
+                    print(f"\n[{futures[future].stem}] FAILED with error: {e_video}")
+    else:
+        for video_path in remaining_videos:
+            allow_interactive = interactive_per_video or shared_camera_offset is None
+            _, _, measured = run_video(video_path, pano_zero_offset_for_rotation, allow_interactive)
+            if measured is not None and SAME_OFFSET_FOR_ALL_VIDEOS and shared_camera_offset is None:
+                shared_camera_offset = measured
+                pano_zero_offset_for_rotation = measured
 
     print("\n\n================ Pipeline Finished ================")
 
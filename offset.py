@@ -4,62 +4,195 @@
 # relative to the vehicle's TrueHeading by clicking a point on the vehicle (typically rear).
 
 import os
+import stat
 import sys
 import json
 import random
+from functools import lru_cache
+import numpy as np
 import matplotlib
 
 # ------------------------------------------------------------------------------
 # FORCE the Qt5Agg backend *before* importing pyplot.  
 matplotlib.use("Qt5Agg")  
 import matplotlib.pyplot as plt
+from matplotlib.backend_bases import MouseButton
 # ------------------------------------------------------------------------------
 
 from pathlib import Path
 
-def _get_user_click_for_offset(image_path: Path, true_heading: float):
+try:
+    # Optional: parses the Mapillary description JSON in native code. The
+    # stock json module builds a Python dict per frame even though only two
+    # fields are read, which is pure interpreter overhead on long videos.
+    import simdjson
+except ImportError:
+    simdjson = None
+
+try:
+    # Optional: incremental JSON parsing, used to stream very large
+    # description files record by record instead of loading them whole.
+    import ijson
+except ImportError:
+    ijson = None
+
+# Description files below this size are parsed in one shot; streaming them
+# with ijson would only add per-item overhead for no memory benefit.
+_STREAM_JSON_THRESHOLD_BYTES = 10 * 1024 * 1024
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Downsample factor for the display strip; sub-degree precision survives
+# because the click math runs in the thumbnail's own coordinates.
+_DISPLAY_DECIMATION = 4
+
+
+@lru_cache(maxsize=8)
+def _cached_display_thumbnail(image_path_str, mtime_ns):
     """
-    Displays a panorama, prompts user to click a reference point on the vehicle
-    (typically directly backward), and calculates the PANO_ZERO_OFFSET.
+    Decodes a panorama downsampled for display, cached on (path, mtime) so
+    re-running the measurement redisplays instantly instead of re-decoding.
+    With PIL available the JPEG is decoded directly at 1/4 scale via draft
+    mode (the decoder skips most DCT work); otherwise the full image is read
+    and decimated by slicing. The mtime_ns argument only keys the cache.
+    """
+    if Image is not None:
+        with Image.open(image_path_str) as pil_img:
+            pil_img.draft("RGB", (pil_img.width // _DISPLAY_DECIMATION,
+                                  pil_img.height // _DISPLAY_DECIMATION))
+            return np.asarray(pil_img.convert("RGB"))
+    return plt.imread(image_path_str)[::_DISPLAY_DECIMATION, ::_DISPLAY_DECIMATION]
+
+
+def _iter_filename_heading_pairs(mapillary_image_description_json_path):
+    """
+    Yields (filename, true_heading) pairs from the mapillary_tools description
+    JSON, reading only the 'filename' and '(MAP)CompassHeading.TrueHeading'
+    fields of each record. Uses simdjson with JSON pointers when available so
+    the extraction happens in native code; falls back to json.load otherwise.
+    Records without a usable heading are skipped. Files larger than
+    _STREAM_JSON_THRESHOLD_BYTES are streamed with ijson (when installed) so
+    memory stays flat regardless of how many frames the video produced.
+    """
+    try:
+        json_size_bytes = os.path.getsize(mapillary_image_description_json_path)
+    except OSError:
+        json_size_bytes = 0
+
+    if ijson is not None and json_size_bytes >= _STREAM_JSON_THRESHOLD_BYTES:
+        with open(mapillary_image_description_json_path, 'rb') as f:
+            for p_meta in ijson.items(f, 'item'):
+                if not isinstance(p_meta, dict):
+                    continue
+                filename = p_meta.get('filename')
+                heading = None
+                for heading_key in ('MAPCompassHeading', 'CompassHeading'):
+                    heading_dict = p_meta.get(heading_key)
+                    if isinstance(heading_dict, dict) and 'TrueHeading' in heading_dict:
+                        heading = heading_dict['TrueHeading']
+                        break
+                if filename and heading is not None:
+                    yield str(filename), heading
+        return
+
+    if simdjson is not None:
+        parser = simdjson.Parser()
+        doc = parser.load(mapillary_image_description_json_path)
+        for rec in doc:
+            try:
+                filename = rec.at_pointer('/filename')
+            except (KeyError, ValueError, TypeError):
+                continue
+            heading = None
+            for pointer in ('/MAPCompassHeading/TrueHeading', '/CompassHeading/TrueHeading'):
+                try:
+                    heading = rec.at_pointer(pointer)
+                    break
+                except (KeyError, ValueError, TypeError):
+                    continue
+            if filename and heading is not None:
+                yield str(filename), heading
+        return
+
+    with open(mapillary_image_description_json_path, 'r') as f:
+        pano_metadata_list = json.load(f)
+    for p_meta in pano_metadata_list:
+        if not isinstance(p_meta, dict):
+            continue
+        filename = p_meta.get('filename')
+        heading = None
+        for heading_key in ('MAPCompassHeading', 'CompassHeading'):
+            heading_dict = p_meta.get(heading_key)
+            if isinstance(heading_dict, dict) and 'TrueHeading' in heading_dict:
+                heading = heading_dict['TrueHeading']
+                break
+        if filename and heading is not None:
+            yield str(filename), heading
+
+
+def _get_user_clicks_for_offset_grid(samples, verbose=False):
+    """
+    Displays several panoramas stacked into one decimated strip and collects
+    one reference click per panorama (on a point directly BACKWARD on the
+    vehicle, e.g. the rear antenna). One window and K clicks replace K
+    sequential open-click-close rounds.
 
     Args:
-        image_path: Path to the equirectangular panorama image.
-        true_heading: The TrueHeading of the vehicle (forward direction) when the panorama was captured.
+        samples: List of (image_path, true_heading) tuples.
 
     Returns:
-        The calculated PANO_ZERO_OFFSET in degrees. This is the value to add
-        to the vehicle's TrueHeading to get the world heading of the panorama's
-        center (0-degree yaw line).
-        Normalized to [-180, 180].
+        The PANO_ZERO_OFFSET in degrees, fitted as the circular mean over all
+        clicks, normalized to [-180, 180]. None if no usable click was made.
+        verbose=True prints the per-click breakdown of the fit.
     """
-    try:
-        img = plt.imread(str(image_path))
-    except FileNotFoundError:
-        print(f"Error: Image not found at {image_path}")
-        return None
-    except Exception as e:
-        print(f"Error reading image {image_path}: {e}")
+    thumbnails = []
+    headings = []
+    for image_path, true_heading in samples:
+        try:
+            mtime_ns = os.stat(image_path).st_mtime_ns
+            img = _cached_display_thumbnail(str(image_path), mtime_ns)
+        except Exception as e:
+            print(f"Error reading image {image_path}: {e}")
+            continue
+        thumbnails.append(img)
+        headings.append(float(true_heading))
+    if not thumbnails:
         return None
 
-    h, w = img.shape[:2]
-    degrees_per_pixel = 360.0 / w
-
-    fig, ax = plt.subplots(figsize=(14, 7))
-    ax.imshow(img)
-    ax.axvline(w / 2,
-               linestyle="--",
-               linewidth=1,
-               color="white",
-               alpha=0.7,
-               label="Pano Center (0° Yaw)")
+    # Stack the thumbnails into one vertical strip (right-padding narrower
+    # rows) so a single axes receives every click and the row index of a
+    # click identifies its panorama.
+    strip_width = max(t.shape[1] for t in thumbnails)
+    padded_rows = []
+    for t in thumbnails:
+        if t.shape[1] < strip_width:
+            pad = np.zeros((t.shape[0], strip_width - t.shape[1]) + t.shape[2:], dtype=t.dtype)
+            t = np.concatenate([t, pad], axis=1)
+        padded_rows.append(t)
+    row_heights = np.array([t.shape[0] for t in thumbnails])
+    row_tops = np.concatenate([[0], np.cumsum(row_heights)])
+    row_widths = np.array([t.shape[1] for t in thumbnails], dtype=float)
+    strip = np.vstack(padded_rows)
+
+    fig, ax = plt.subplots(figsize=(14, min(2.5 * len(thumbnails), 14)))
+    ax.imshow(strip)
+    for row_index in range(len(thumbnails)):
+        center_x = row_widths[row_index] / 2
+        ax.plot([center_x, center_x], [row_tops[row_index], row_tops[row_index + 1]],
+                linestyle="--", linewidth=1, color="white", alpha=0.7)
+        if row_index:
+            ax.axhline(row_tops[row_index], color="yellow", linewidth=1)
+    ax.set_yticks([])
 
     instruction_text = (
-        f"Vehicle TrueHeading (FORWARD): {true_heading:.2f}°\n"
-        f"Image: {image_path.name}\n\n"
-        "1. Identify a point directly BACKWARD on the vehicle "
-        "(e.g., rear antenna, center of rear bumper).\n"
-        "2. Click on that point in the image.\n"
-        "3. Close this window to continue."
+        f"{len(thumbnails)} panoramas, dashed line = pano center (0° yaw).\n"
+        "1. In EACH panorama, click a point directly BACKWARD on the vehicle\n"
+        "   (e.g., rear antenna, center of rear bumper).\n"
+        f"2. After {len(thumbnails)} clicks the window closes automatically\n"
+        "   (right-click to finish early with fewer clicks)."
     )
     fig.text(0.5,
              0.98,
@@ -69,57 +202,60 @@ def _get_user_click_for_offset(image_path: Path, true_heading: float):
              fontsize=10,
              color="black",
              bbox=dict(boxstyle="round,pad=0.5", fc="yellow", alpha=0.8))
-
-    ax.set_title("Measure Camera Yaw Offset by Clicking Vehicle's REAR Point")
-    plt.legend()
+    ax.set_title("Measure Camera Yaw Offset by Clicking Each Vehicle's REAR Point")
 
     if sys.platform.startswith("linux") and "DISPLAY" not in os.environ:
         print("Warning: Likely headless Linux—skipping interactive offset.")
         plt.close(fig)
-        return 0.0
+        return None
 
     fig.show()
     plt.pause(0.1)
 
-
     try:
-        click_points = plt.ginput(1, timeout=-1)  # waits indefinitely for one click
+        # Buttons are passed explicitly so they match the on-screen text:
+        # ginput's defaults make right-click *delete* the last click and
+        # middle-click stop, which would strand a user following the
+        # instructions with timeout=-1.
+        click_points = plt.ginput(len(thumbnails), timeout=-1,
+                                  mouse_stop=MouseButton.RIGHT,
+                                  mouse_pop=MouseButton.MIDDLE)
     except Exception as e:
-        print(f"Could not get GUI input (environment issue?): {e}. Returning default offset 0.0.")
+        print(f"Could not get GUI input (environment issue?): {e}. No offset measured.")
         plt.close(fig)
-        return 0.0
+        return None
 
     plt.close(fig)
 
     if not click_points:
-        print("No point selected. Cannot calculate offset.")
+        print("No points selected. Cannot calculate offset.")
         return None
 
-    x_click, _ = click_points[0]
+    # --- OFFSET CALCULATION (vectorized over all clicks) ---
+    clicks = np.asarray(click_points, dtype=float)
+    row_indices = np.clip(np.searchsorted(row_tops, clicks[:, 1], side="right") - 1,
+                          0, len(thumbnails) - 1)
+    widths = row_widths[row_indices]
+    clicked_headings = np.asarray(headings)[row_indices]
 
-    # --- OFFSET CALCULATION ---
-    dx_pixels = x_click - (w / 2)
-    dx_degrees_pano_coord = dx_pixels * degrees_per_pixel
-    vehicle_rear_world_heading = (true_heading + 180.0) % 360.0
+    dx_degrees_pano_coord = (clicks[:, 0] - widths / 2) * (360.0 / widths)
+    vehicle_rear_world_heading = (clicked_headings + 180.0) % 360.0
     camera_optical_axis_world_heading = (
         vehicle_rear_world_heading - dx_degrees_pano_coord + 360.0
     ) % 360.0
-    offset = ((camera_optical_axis_world_heading - true_heading + 180.0) % 360.0) - 180.0
-
-    print(f"\n--- Offset Calculation (Clicked REAR point) ---")
-    print(f"Image: {image_path.name}")
-    print(f"Image width: {w}px, Degrees per pixel: {degrees_per_pixel:.3f}")
-    print(f"Clicked X-coordinate (REAR reference): {x_click:.2f}px")
-    print(f"Center X-coordinate of Panorama: {w/2:.2f}px")
-    print(f"Pixel difference of click from center (dx_pixels): {dx_pixels:.2f}px")
-    print(f"Angular position of clicked REAR point in pano (dx_degrees_pano_coord): {dx_degrees_pano_coord:.2f}°")
-    print(f"Vehicle TrueHeading (FORWARD): {true_heading:.2f}°")
-    print(f"Calculated Vehicle REAR World Heading: {vehicle_rear_world_heading:.2f}°")
-    print(f"Calculated Camera Optical Axis World Heading (Pano Center): {camera_optical_axis_world_heading:.2f}°")
-    print(f"Calculated PANO_ZERO_OFFSET: {offset:+.2f}°")
-    print("(This means the panorama's center is oriented "
-          f"{offset:+.2f}° from the vehicle's FORWARD heading)")
-    print("--------------------------------------------------\n")
+    per_click_offsets = ((camera_optical_axis_world_heading - clicked_headings + 180.0) % 360.0) - 180.0
+
+    # Circular mean: plain averaging breaks at the ±180° wrap.
+    offsets_rad = np.radians(per_click_offsets)
+    offset = float(np.degrees(np.arctan2(np.sin(offsets_rad).mean(), np.cos(offsets_rad).mean())))
+
+    if verbose:
+        print(f"\n--- Offset Calculation ({len(clicks)} clicked REAR points) ---")
+        for click_index in range(len(clicks)):
+            print(f"Pano {row_indices[click_index] + 1}: click at {clicks[click_index, 0]:.1f}px "
+                  f"-> offset {per_click_offsets[click_index]:+.2f}°")
+        print("--------------------------------------------------")
+    print(f"Calculated PANO_ZERO_OFFSET (circular mean of {len(clicks)} clicks): {offset:+.2f}°")
 
     return offset
 
@@ -130,8 +266,10 @@ def measure_yaw_offset_interactively(
 ) -> float:
     """
     Allows the user to interactively measure the camera yaw offset.
-    Selects a random panorama, displays it, and prompts the user to click
-    a reference point on the vehicle (typically directly backward).
+    Selects a handful of random panoramas, shows them in one window, and fits
+    the offset from one reference click per panorama (typically a point
+    directly backward on the vehicle). Averaging several clicks damps both
+    click jitter and per-frame GPS heading noise.
 
     Args:
         panoramas_image_dir: Base directory containing the sampled equirectangular panoramas (JPGs).
@@ -141,76 +279,71 @@ def measure_yaw_offset_interactively(
                                                which includes TrueHeading for each image.
 
     Returns:
-        The measured yaw offset (PANO_ZERO_OFFSET) in degrees, or 0.0 if measurement fails or is skipped.
+        The measured yaw offset (PANO_ZERO_OFFSET) in degrees, or None if
+        measurement fails or is skipped. Callers must not treat a failure as
+        a measured 0.0 (and in particular must not persist it).
     """
     if not os.path.isdir(panoramas_image_dir):
         print(f"Error: Panoramas base directory not found: {panoramas_image_dir}")
-        return 0.0
+        return None
     if not os.path.isfile(mapillary_image_description_json_path):
         print(f"Error: Mapillary image description JSON not found: {mapillary_image_description_json_path}")
-        return 0.0
+        return None
 
+    # Reservoir-sample the panoramas to display (Algorithm R, k slots) while
+    # streaming the records: every valid record is equally likely to end up in
+    # the reservoir, memory stays O(k) however many frames the video has, and
+    # only the handful of chosen paths is ever stat()ed.
+    RESERVOIR_SIZE = 6
+    reservoir = []  # (path_str, heading) tuples
+    records_seen = 0
     try:
-        with open(mapillary_image_description_json_path, 'r') as f:
-            pano_metadata_list = json.load(f)
+        for json_filename_str, true_heading_value in _iter_filename_heading_pairs(
+                mapillary_image_description_json_path):
+            try:
+                heading_float = float(true_heading_value)
+            except (ValueError, TypeError):
+                continue
+            if len(reservoir) < RESERVOIR_SIZE:
+                reservoir.append((json_filename_str, heading_float))
+            else:
+                slot = random.randint(0, records_seen)
+                if slot < RESERVOIR_SIZE:
+                    reservoir[slot] = (json_filename_str, heading_float)
+            records_seen += 1
     except Exception as e:
         print(f"Error reading metadata JSON {mapillary_image_description_json_path}: {e}")
-        return 0.0
-
-    if not pano_metadata_list:
-        print(f"No panorama metadata found in JSON file: {mapillary_image_description_json_path}")
-        return 0.0
+        return None
 
-    heading_map = {}
-    for p_meta in pano_metadata_list:
+    # Verify only the chosen paths (one stat each) instead of every record.
+    samples = []
+    for json_filename_str, heading_float in reservoir:
         try:
-            json_filename_str = p_meta.get('filename')
-            if not json_filename_str:
-                continue
+            if stat.S_ISREG(os.stat(json_filename_str).st_mode):
+                samples.append((Path(json_filename_str), heading_float))
+        except OSError:
+            continue
 
-            path_from_json = Path(json_filename_str)
-            if path_from_json.exists() and path_from_json.is_file():
-                true_heading_value = None
-                if 'MAPCompassHeading' in p_meta \
-                   and isinstance(p_meta['MAPCompassHeading'], dict) \
-                   and 'TrueHeading' in p_meta['MAPCompassHeading']:
-                    true_heading_value = p_meta['MAPCompassHeading']['TrueHeading']
-                elif 'CompassHeading' in p_meta \
-                     and isinstance(p_meta['CompassHeading'], dict) \
-                     and 'TrueHeading' in p_meta['CompassHeading']:
-                    true_heading_value = p_meta['CompassHeading']['TrueHeading']
-
-                if true_heading_value is not None:
-                    try:
-                        heading_map[str(path_from_json)] = float(true_heading_value)
-                    except (ValueError, TypeError):
-                        pass
-        except Exception:
-            pass
-
-    if not heading_map:
+    if not samples:
         print(f"No image files with valid TrueHeading found based on the paths in '{mapillary_image_description_json_path}'.")
         print("Possible reasons:")
         print("1. The 'filename' entries in the JSON do not point to existing image files.")
         print("2. The existing image files listed in the JSON do not have a valid 'MAPCompassHeading.TrueHeading' field.")
         print("Please verify the content of the JSON and the existence/permissions of the image files.")
-        return 0.0
+        return None
 
-    valid_image_paths_with_heading = list(heading_map.keys())
-    chosen_image_path_str = random.choice(valid_image_paths_with_heading)
-    chosen_image_path_obj = Path(chosen_image_path_str)
-    true_heading_for_chosen_image = heading_map[chosen_image_path_str]
+    sample_count = len(samples)
+    chosen_image_paths = [str(p) for p, _ in samples]
 
     print("\nStarting interactive yaw offset measurement...")
-    print(f"Using randomly selected panorama: {chosen_image_path_obj.name}")
-    print(f"Vehicle TrueHeading (FORWARD) for this image: {true_heading_for_chosen_image:.2f}°")
+    print(f"Using {sample_count} randomly selected panorama(s): "
+          + ", ".join(Path(p).name for p in chosen_image_paths))
 
-    measured_offset = _get_user_click_for_offset(chosen_image_path_obj,
-                                                true_heading_for_chosen_image)
+    measured_offset = _get_user_clicks_for_offset_grid(samples)
 
     if measured_offset is None:
         print("Offset measurement failed or was cancelled by the user.")
-        return 0.0
+        return None
 
     print(f"Interactive measurement complete. Measured PANO_ZERO_OFFSET: {measured_offset:+.2f}°")
     return measured_offset
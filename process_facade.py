@@ -12,23 +12,44 @@ import os
 import json
 import csv
 import warnings
+import numpy as np
 import geopandas as gpd
+import shapely
+from shapely import STRtree
 from shapely.geometry import Point
 from tqdm import tqdm
 from utils import (
+    GEOJSON_READ_KWARGS,
     ensure_dir_exists,
-    great_circle_bearing,
-    angular_difference,
-    find_front_edge,
-    calculate_edge_normal_bearing
+    get_transformer,
+    great_circle_bearings,
+    find_front_edge_from_array,
+    polygon_edge_array
 )
 
+# pyarrow (already pulled in by geopandas' parquet support) lets downstream
+# stages memory-map the matches instead of re-parsing CSV text; optional.
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# orjson parses the (often tens of MB) Mapillary description several times
+# faster than stdlib json; optional like elsewhere in the pipeline.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 def process_building_footprints(
     mapillary_image_description_json_path: str,
     footprint_geojson_path: str,
     base_output_dir: str,
     max_distance_to_building_m: float,
-    frontal_view_tolerance_deg: float
+    frontal_view_tolerance_deg: float,
+    _footprint_gdf_override=None
 ):
     """
     Enumerates frontal façades for each panorama.
@@ -43,9 +64,15 @@ def process_building_footprints(
                                     to consider a building.
         frontal_view_tolerance_deg: Maximum angle (degrees) between the camera-to-façade-midpoint
                                     ray and the outward normal of the façade edge.
+        _footprint_gdf_override: Optional pre-loaded footprints GeoDataFrame. When given,
+                                 it is used directly and footprint_geojson_path is never read,
+                                 letting callers skip a GeoJSON serialize/parse round-trip.
 
     Returns:
-        Path to the output CSV file containing panorama-façade matches, or None if an error occurs.
+        A tuple (output_csv_path, match_rows) where match_rows is the in-memory
+        list of row dicts that was written to the CSV, or (None, None) on error.
+        Callers running the rotation stage in the same process can hand
+        match_rows straight to it and skip re-parsing the CSV.
     """
     output_csv_dir = os.path.join(base_output_dir, "03_intermediate_data")
     ensure_dir_exists(output_csv_dir)
@@ -53,13 +80,16 @@ def process_building_footprints(
 
     if not os.path.exists(mapillary_image_description_json_path):
         print(f"Error: Mapillary metadata JSON not found at {mapillary_image_description_json_path}")
-        return None
-    if not os.path.exists(footprint_geojson_path):
+        return None, None
+    if _footprint_gdf_override is None and not os.path.exists(footprint_geojson_path):
         print(f"Error: Building footprint GeoJSON not found at {footprint_geojson_path}")
-        return None
+        return None, None
 
     try:
-        gdf_buildings_wgs84 = gpd.read_file(footprint_geojson_path)
+        if _footprint_gdf_override is not None:
+            gdf_buildings_wgs84 = _footprint_gdf_override
+        else:
+            gdf_buildings_wgs84 = gpd.read_file(footprint_geojson_path, **GEOJSON_READ_KWARGS)
         if gdf_buildings_wgs84.crs.to_epsg() != 4326:
              gdf_buildings_wgs84 = gdf_buildings_wgs84.to_crs(epsg=4326)
         
@@ -69,18 +99,79 @@ def process_building_footprints(
         gdf_buildings_metric = gdf_buildings_wgs84.to_crs(epsg=3857)
     except Exception as e:
         print(f"Error reading or reprojecting GeoJSON {footprint_geojson_path}: {e}")
-        return None
+        return None, None
 
     try:
-        with open(mapillary_image_description_json_path, 'r') as f:
-            panoramas_metadata = json.load(f)
+        with open(mapillary_image_description_json_path, 'rb') as f:
+            raw_metadata = f.read()
+        panoramas_metadata = orjson.loads(raw_metadata) if orjson is not None else json.loads(raw_metadata)
     except Exception as e:
         print(f"Error reading panorama metadata {mapillary_image_description_json_path}: {e}")
-        return None
+        return None, None
 
     if not panoramas_metadata:
         print("No panorama metadata loaded. Cannot process façades.")
-        return None
+        return None, None
+
+    # Project every camera position to the metric CRS in one vectorized
+    # transform instead of building a one-row GeoSeries (and with it a CRS
+    # object and PROJ pipeline) per panorama. Unparseable coordinates become
+    # NaN here and fail per-panorama below, as they always did.
+    def _coordinate_or_nan(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return float("nan")
+
+    pano_count = len(panoramas_metadata)
+    pano_lats = np.fromiter((_coordinate_or_nan(p.get("MAPLatitude")) for p in panoramas_metadata),
+                            dtype=np.float64, count=pano_count)
+    pano_lons = np.fromiter((_coordinate_or_nan(p.get("MAPLongitude")) for p in panoramas_metadata),
+                            dtype=np.float64, count=pano_count)
+    camera_xs_metric, camera_ys_metric = get_transformer(4326, 3857).transform(pano_lons, pano_lats)
+    camera_points_metric = shapely.points(camera_xs_metric, camera_ys_metric)
+
+    # Spatial index over building centroids (metric CRS), built once: each
+    # panorama queries O(log N + k) candidates instead of a full O(N)
+    # distance pass over every footprint.
+    centroid_geoms_metric = gdf_buildings_metric.geometry.centroid.values
+    centroid_tree = STRtree(centroid_geoms_metric)
+    building_index_labels = gdf_buildings_metric.index.to_numpy()
+
+    # Structure-of-arrays view of the footprint attributes: the inner loop
+    # indexes plain numpy arrays by the positions the STRtree returns, instead
+    # of materializing a pandas Series per building via label-based .loc.
+    building_count = len(gdf_buildings_wgs84)
+    building_polygons_wgs84 = gdf_buildings_wgs84.geometry.values
+
+    def _attribute_column(column_name):
+        if column_name in gdf_buildings_wgs84.columns:
+            return gdf_buildings_wgs84[column_name].to_numpy()
+        return np.full(building_count, "", dtype=object)
+
+    bld_heights = _attribute_column("HEIGHT")
+    bld_elevations = _attribute_column("ELEV")
+    bld_sources = _attribute_column("SOURCE")
+    bld_capture_dates = _attribute_column("DATE_")
+    bld_statuses = _attribute_column("STATUS")
+    # Ring edges flattened to one (N, 4) array per building, computed once:
+    # the front-edge search then runs as vectorized numpy trig over all of a
+    # polygon's edges at once instead of a per-edge Python loop.
+    building_edge_arrays = [polygon_edge_array(polygon) for polygon in building_polygons_wgs84]
+
+    # WGS84 centroid coordinates, computed once per building rather than once
+    # per (panorama, candidate) pair; the per-candidate bearings below then
+    # come from one vectorized trig pass.
+    building_centroids_wgs84 = shapely.centroid(building_polygons_wgs84)
+    centroid_lons_wgs84 = shapely.get_x(building_centroids_wgs84)
+    centroid_lats_wgs84 = shapely.get_y(building_centroids_wgs84)
+
+    if "BLD_ID" in gdf_buildings_wgs84.columns:
+        bld_id_values = gdf_buildings_wgs84["BLD_ID"].to_numpy()
+    elif "id" in gdf_buildings_wgs84.columns:
+        bld_id_values = gdf_buildings_wgs84["id"].to_numpy()
+    else:
+        bld_id_values = None
 
     output_rows = []
     header = [
@@ -92,100 +183,123 @@ def process_building_footprints(
     ]
 
     print(f"Processing {len(panoramas_metadata)} panoramas to find facade matches...")
-    with warnings.catch_warnings(): # Suppress UserWarning about geographic CRS from geopandas distance
+    # The CSV is written row by row as matches are found, so results reach
+    # disk incrementally instead of being buffered for one big write at the
+    # end. output_rows is still kept: same-process callers take it as the
+    # in-memory handoff to the rotation stage.
+    try:
+        fp_csv = open(output_csv_path, "w", newline="", encoding="utf-8")
+    except Exception as e_csv:
+        print(f"Error opening CSV output {output_csv_path}: {e_csv}")
+        return None, None
+    with fp_csv, warnings.catch_warnings(): # Suppress UserWarning about geographic CRS from geopandas distance
         warnings.filterwarnings("ignore", category=UserWarning, message="Geometry is in a geographic CRS.*")
+        csv_writer = csv.DictWriter(fp_csv, fieldnames=header)
+        csv_writer.writeheader()
 
-        for pano_meta in tqdm(panoramas_metadata, desc="Processing Facades"):
+        for pano_position, pano_meta in enumerate(tqdm(panoramas_metadata, desc="Processing Facades")):
             try:
-                pano_lat = float(pano_meta["MAPLatitude"])
-                pano_lon = float(pano_meta["MAPLongitude"])
+                pano_lat = pano_lats[pano_position]
+                pano_lon = pano_lons[pano_position]
+                if not (np.isfinite(pano_lat) and np.isfinite(pano_lon)):
+                    raise ValueError("missing or unparseable MAPLatitude/MAPLongitude")
                 pano_true_heading = float(pano_meta.get("MAPCompassHeading", {}).get("TrueHeading", 0.0))
                 # mapillary_image_description.json 'filename' is often absolute
                 pano_abs_path = pano_meta["filename"] 
                 pano_filename = os.path.basename(pano_abs_path)
 
+                camera_point_metric = camera_points_metric[pano_position]
 
-                # Create a GeoSeries for the camera point in metric CRS for distance calculation
-                camera_point_wgs84 = Point(pano_lon, pano_lat)
-                camera_point_metric = gpd.GeoSeries([camera_point_wgs84], crs="EPSG:4326").to_crs(epsg=3857)[0]
-
-                # Calculate distances from camera to all building centroids (in metric)
-                # Using .geometry access to avoid warning if gdf_buildings_metric has no active geometry column set by name
-                distances_to_centroids = gdf_buildings_metric.geometry.centroid.distance(camera_point_metric)
-                
-                # Filter buildings that are within max_distance_to_building_m
-                # gdf_buildings_metric['dist_to_cam'] = distances_to_centroids
-                # nearby_buildings_metric = gdf_buildings_metric[gdf_buildings_metric['dist_to_cam'] <= max_distance_to_building_m]
-                
-                # Efficiently get indices of nearby buildings
-                nearby_indices = distances_to_centroids[distances_to_centroids <= max_distance_to_building_m].index
-
-
-                for bld_idx in nearby_indices:
-                    building_metric = gdf_buildings_metric.loc[bld_idx]
-                    building_wgs84 = gdf_buildings_wgs84.loc[bld_idx] # Original WGS84 for lat/lon geometry
-                    
-                    building_polygon_wgs84 = building_wgs84.geometry
-                    if not isinstance(building_polygon_wgs84, gpd.array.GeometryDtype.type): # Check if it's a shapely geometry
-                         if hasattr(building_polygon_wgs84, 'iloc') and len(building_polygon_wgs84) > 0:
-                            building_polygon_wgs84 = building_polygon_wgs84.iloc[0] # if it's a GeoSeries
-                         elif not hasattr(building_polygon_wgs84, 'geom_type'): # if not a shapely geometry at all
-                            print(f"Warning: Building {bld_idx} has unexpected geometry type {type(building_polygon_wgs84)}. Skipping.")
-                            continue
-
-
-                    bld_centroid_wgs84 = building_polygon_wgs84.centroid
-                    bld_centroid_lon, bld_centroid_lat = bld_centroid_wgs84.x, bld_centroid_wgs84.y
-                    
-                    # Bearing from camera to building centroid
-                    bearing_cam_to_bld_centroid = great_circle_bearing(pano_lat, pano_lon, bld_centroid_lat, bld_centroid_lon)
+                # Candidate buildings from the spatial index. The buffer is
+                # padded slightly because a polygonal buffer is inscribed in
+                # the true circle; the exact distance filter below decides.
+                candidate_positions = centroid_tree.query(
+                    camera_point_metric.buffer(max_distance_to_building_m * 1.01),
+                    predicate="intersects"
+                )
+                if candidate_positions.size == 0:
+                    continue
+                candidate_distances = shapely.distance(
+                    centroid_geoms_metric[candidate_positions], camera_point_metric)
+                within_range = candidate_distances <= max_distance_to_building_m
+                nearby_positions = candidate_positions[within_range]
+                nearby_distances = candidate_distances[within_range]
 
-                    # Find the "front" edge of this building relative to the camera
-                    facade_edge_coords = find_front_edge(building_polygon_wgs84, pano_lat, pano_lon, bearing_cam_to_bld_centroid)
+                # One vectorized trig pass covers the camera-to-centroid
+                # bearings of every candidate.
+                candidate_bearings = great_circle_bearings(
+                    pano_lat, pano_lon,
+                    centroid_lats_wgs84[nearby_positions], centroid_lons_wgs84[nearby_positions])
 
+                # Pick each candidate's front edge first, then run the
+                # frontal test for all of them in one vectorized pass: the
+                # midpoint yaw, edge normal and angular difference become
+                # three array expressions instead of per-candidate calls.
+                edge_positions = []
+                edge_distances = []
+                edge_coords = []  # (lon1, lat1, lon2, lat2) per kept candidate
+                for gdf_position, distance_to_centroid_m, bearing_cam_to_bld_centroid in zip(
+                        nearby_positions, nearby_distances, candidate_bearings):
+                    # Find the "front" edge of this building relative to the camera
+                    facade_edge_coords = find_front_edge_from_array(
+                        building_edge_arrays[gdf_position], pano_lat, pano_lon, bearing_cam_to_bld_centroid)
                     if not facade_edge_coords:
                         continue # No suitable edge found
-
                     (edge_lon1, edge_lat1), (edge_lon2, edge_lat2) = facade_edge_coords
-                    
-                    # Calculate midpoint of the identified facade edge
-                    facade_mid_lon = (edge_lon1 + edge_lon2) / 2
-                    facade_mid_lat = (edge_lat1 + edge_lat2) / 2
-                    
-                    # Bearing from camera to the facade midpoint (this is the desired yaw)
-                    desired_camera_yaw = great_circle_bearing(pano_lat, pano_lon, facade_mid_lat, facade_mid_lon)
-                    
-                    # Calculate the outward normal of this facade edge
-                    facade_normal_bearing = calculate_edge_normal_bearing(edge_lon1, edge_lat1, edge_lon2, edge_lat2)
-                    
-                    # Check if the facade is "frontal" enough
-                    # Angle between camera-to-midpoint ray and facade's outward normal
-                    angle_diff_ray_normal = angular_difference(desired_camera_yaw, facade_normal_bearing)
-
-                    if angle_diff_ray_normal <= frontal_view_tolerance_deg:
-                        # This facade is considered frontal enough, record it
-                        row = {
-                            "pano_filename": pano_filename,
-                            "pano_abs_path": pano_abs_path,
-                            "pano_latitude": pano_lat,
-                            "pano_longitude": pano_lon,
-                            "pano_true_heading": pano_true_heading,
-                            "BLD_ID": str(building_wgs84.get("BLD_ID", building_wgs84.get("id", f"Unknown_{bld_idx}"))), # Handle missing BLD_ID
-                            "bld_height": building_wgs84.get("HEIGHT", ""),
-                            "bld_elevation": building_wgs84.get("ELEV", ""),
-                            "bld_source_dataset": building_wgs84.get("SOURCE", ""),
-                            "bld_capture_date": building_wgs84.get("DATE_", ""), # Original script used DATE_
-                            "bld_status": building_wgs84.get("STATUS", ""),
-                            "distance_to_centroid_m": distances_to_centroids[bld_idx], # Use pre-calculated metric distance
-                            "desired_camera_yaw_to_facade": desired_camera_yaw,
-                            "bld_centroid_lon": bld_centroid_lon,
-                            "bld_centroid_lat": bld_centroid_lat,
-                            "facade_edge_lon1": edge_lon1,
-                            "facade_edge_lat1": edge_lat1,
-                            "facade_edge_lon2": edge_lon2,
-                            "facade_edge_lat2": edge_lat2,
-                        }
-                        output_rows.append(row)
+                    edge_positions.append(gdf_position)
+                    edge_distances.append(distance_to_centroid_m)
+                    edge_coords.append((edge_lon1, edge_lat1, edge_lon2, edge_lat2))
+
+                if not edge_coords:
+                    continue
+                edge_coords = np.asarray(edge_coords, dtype=np.float64)
+                # Bearings from camera to the facade midpoints (the desired yaws)
+                facade_mid_lons = (edge_coords[:, 0] + edge_coords[:, 2]) / 2
+                facade_mid_lats = (edge_coords[:, 1] + edge_coords[:, 3]) / 2
+                desired_camera_yaws = great_circle_bearings(
+                    pano_lat, pano_lon, facade_mid_lats, facade_mid_lons)
+                # Outward normals of the facade edges (CCW exterior: edge
+                # bearing minus 90, as in calculate_edge_normal_bearing)
+                edge_bearings = great_circle_bearings(
+                    edge_coords[:, 1], edge_coords[:, 0], edge_coords[:, 3], edge_coords[:, 2])
+                facade_normal_bearings = (edge_bearings - 90.0) % 360.0
+                # Angle between camera-to-midpoint ray and facade's outward normal
+                angle_diffs_ray_normal = np.abs(
+                    ((desired_camera_yaws - facade_normal_bearings + 180.0) % 360.0) - 180.0)
+
+                for kept_index in np.flatnonzero(angle_diffs_ray_normal <= frontal_view_tolerance_deg):
+                    gdf_position = edge_positions[kept_index]
+                    bld_idx = building_index_labels[gdf_position]
+                    distance_to_centroid_m = edge_distances[kept_index]
+                    desired_camera_yaw = desired_camera_yaws[kept_index]
+                    edge_lon1, edge_lat1, edge_lon2, edge_lat2 = edge_coords[kept_index]
+                    bld_centroid_lon = centroid_lons_wgs84[gdf_position]
+                    bld_centroid_lat = centroid_lats_wgs84[gdf_position]
+
+                    # This facade is considered frontal enough, record it
+                    row = {
+                        "pano_filename": pano_filename,
+                        "pano_abs_path": pano_abs_path,
+                        "pano_latitude": pano_lat,
+                        "pano_longitude": pano_lon,
+                        "pano_true_heading": pano_true_heading,
+                        "BLD_ID": str(bld_id_values[gdf_position]) if bld_id_values is not None else f"Unknown_{bld_idx}", # Handle missing BLD_ID
+                        "bld_height": bld_heights[gdf_position],
+                        "bld_elevation": bld_elevations[gdf_position],
+                        "bld_source_dataset": bld_sources[gdf_position],
+                        "bld_capture_date": bld_capture_dates[gdf_position], # Original script used DATE_
+                        "bld_status": bld_statuses[gdf_position],
+                        "distance_to_centroid_m": distance_to_centroid_m, # From the index query's exact check
+                        "desired_camera_yaw_to_facade": desired_camera_yaw,
+                        "bld_centroid_lon": bld_centroid_lon,
+                        "bld_centroid_lat": bld_centroid_lat,
+                        "facade_edge_lon1": edge_lon1,
+                        "facade_edge_lat1": edge_lat1,
+                        "facade_edge_lon2": edge_lon2,
+                        "facade_edge_lat2": edge_lat2,
+                    }
+                    output_rows.append(row)
+                    csv_writer.writerow(row)
             except Exception as e_pano:
                 print(f"Error processing panorama {pano_meta.get('filename', 'Unknown')}: {e_pano}")
                 # import traceback
@@ -195,13 +309,22 @@ def process_building_footprints(
         print("No facade matches found for any panorama.")
     else:
         try:
-            with open(output_csv_path, "w", newline="", encoding="utf-8") as fp_csv:
-                writer = csv.DictWriter(fp_csv, fieldnames=header)
-                writer.writeheader()
-                writer.writerows(output_rows)
             print(f"✅ Facade processing complete. Matches saved to → {output_csv_path}")
+            if pa is not None:
+                # Dictionary-encoded Parquet sibling: the rotation stage opens
+                # it memory-mapped, so worker processes share pages and skip
+                # the O(rows) CSV text parse. The CSV remains the inspectable
+                # copy of record.
+                try:
+                    pq.write_table(
+                        pa.Table.from_pylist(output_rows),
+                        os.path.splitext(output_csv_path)[0] + ".parquet",
+                        use_dictionary=True
+                    )
+                except Exception as e_parquet:
+                    print(f"Warning: Could not write Parquet sibling for matches CSV: {e_parquet}")
         except Exception as e_csv:
             print(f"Error writing CSV output to {output_csv_path}: {e_csv}")
-            return None
+            return None, None
             
-    return output_csv_path
\ No newline at end of file
+    return output_csv_path, output_rows
\ No newline at end of file
@@ -11,25 +11,55 @@ Outputs rotated panoramas and a JSON metadata file.
 """
 import os
 import json
-import math
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
 from PIL import Image
-from equilib import equi2equi # Ensure equilib is installed
 from tqdm import tqdm
 from utils import (
     ensure_dir_exists,
-    great_circle_bearing,
-    signed_angular_difference,
-    calculate_distance_meters
+    great_circle_bearing
 )
 
+# Optional: read the façade stage's Parquet sibling memory-mapped instead of
+# parsing CSV text.
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+# orjson encodes the rotation metadata several times faster than stdlib json.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Optional: libjpeg-turbo's SIMD encoder for the rotated outputs; Pillow's
+# stock libjpeg encode is several times slower on 6K panoramas.
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+    _turbo_jpeg = TurboJPEG()
+except Exception:
+    _turbo_jpeg = None
+
+
+def _save_rotated_jpeg(image_hwc_rgb, output_image_path):
+    """Encodes and writes one rotated panorama (turbojpeg when available)."""
+    if _turbo_jpeg is not None:
+        jpeg_bytes = _turbo_jpeg.encode(image_hwc_rgb, quality=90, pixel_format=TJPF_RGB)
+        with open(output_image_path, "wb") as f_out:
+            f_out.write(jpeg_bytes)
+    else:
+        Image.fromarray(image_hwc_rgb).save(output_image_path)
+
 def rotate_panoramas_to_facades(
     facade_matches_csv_path: str,
     source_panoramas_dir: str, # Dir containing original (or blurred) panos listed in CSV
     base_output_dir: str,
     measured_camera_offset_deg: float, # PANO_ZERO_OFFSET
-    distance_cutoff_m: float # Max distance to consider for rotation
+    distance_cutoff_m: float, # Max distance to consider for rotation
+    facade_matches_rows: list = None, # Optional in-memory rows from process_facade
+    write_rotated_images: bool = True # False defers the roll to the extraction stage
 ):
     """
     Rotates panoramas based on the facade matching CSV.
@@ -43,30 +73,59 @@ def rotate_panoramas_to_facades(
                                     relative to the vehicle's true heading.
                                     (PANO_ZERO_OFFSET: positive if camera is right of vehicle heading).
         distance_cutoff_m: Filter out matches where building centroid is further than this.
+        facade_matches_rows: Optional list of match row dicts as returned by
+                             process_facade in the same process. When given, the
+                             CSV at facade_matches_csv_path is never parsed.
+        write_rotated_images: When False, no rotated JPGs are decoded, rolled
+                              or written; only the metadata records are
+                              produced, tagged so the cube extraction stage
+                              applies the column roll itself while sampling.
+                              Skips one JPEG encode+decode per panorama when
+                              rotation and extraction run back to back.
 
     Returns:
-        A tuple (rotated_panos_dir, rotated_meta_json_path) or (None, None) if an error.
+        A tuple (rotated_panos_dir, rotated_meta_json_path, metadata_records)
+        or (None, None, None) if an error. metadata_records is the in-memory
+        list that was written to the JSON file, so a same-process extraction
+        stage can consume it without re-reading the JSON.
     """
     rotated_panos_dir = os.path.join(base_output_dir, "04_rotated_panoramas")
     ensure_dir_exists(rotated_panos_dir)
     rotated_meta_json_path = os.path.join(rotated_panos_dir, "rotated_panoramas_metadata.json")
 
-    if not os.path.exists(facade_matches_csv_path):
-        print(f"Error: Facade matches CSV not found at {facade_matches_csv_path}")
-        return None, None
-    
-    try:
-        df_matches = pd.read_csv(facade_matches_csv_path)
-    except Exception as e:
-        print(f"Error reading facade matches CSV {facade_matches_csv_path}: {e}")
-        return None, None
+    if facade_matches_rows is not None:
+        # Matches handed over in-memory by the façade stage: skip the CSV parse.
+        df_matches = pd.DataFrame(facade_matches_rows)
+    else:
+        if not os.path.exists(facade_matches_csv_path):
+            print(f"Error: Facade matches CSV not found at {facade_matches_csv_path}")
+            return None, None, None
+
+        df_matches = None
+        parquet_sibling = os.path.splitext(facade_matches_csv_path)[0] + ".parquet"
+        if pq is not None and os.path.exists(parquet_sibling) \
+                and os.path.getmtime(parquet_sibling) >= os.path.getmtime(facade_matches_csv_path):
+            # The façade stage writes a Parquet copy of the matches; opening it
+            # memory-mapped shares pages across worker processes and avoids
+            # the O(rows) CSV text parse.
+            try:
+                df_matches = pq.read_table(parquet_sibling, memory_map=True).to_pandas()
+            except Exception as e_parquet:
+                print(f"Warning: Could not read Parquet matches ({e_parquet}); falling back to CSV.")
+                df_matches = None
+        if df_matches is None:
+            try:
+                df_matches = pd.read_csv(facade_matches_csv_path)
+            except Exception as e:
+                print(f"Error reading facade matches CSV {facade_matches_csv_path}: {e}")
+                return None, None, None
 
     if df_matches.empty:
         print("Facade matches CSV is empty. No panoramas to rotate.")
         # Create empty metadata and return
         with open(rotated_meta_json_path, "w") as fp:
             json.dump([], fp)
-        return rotated_panos_dir, rotated_meta_json_path
+        return rotated_panos_dir, rotated_meta_json_path, []
 
     # Filter by distance to centroid (already in CSV, but can re-filter if needed)
     # The CSV from facade_processor already contains 'distance_to_centroid_m'
@@ -84,11 +143,19 @@ def rotate_panoramas_to_facades(
             # Attempt to compute distance_to_centroid_m if missing and other cols exist
             if col == 'distance_to_centroid_m' and all(c in df_matches.columns for c in ['pano_latitude', 'pano_longitude', 'bld_centroid_lat', 'bld_centroid_lon']):
                 print("Attempting to calculate 'distance_to_centroid_m'...")
-                df_matches['distance_to_centroid_m'] = df_matches.apply(
-                    lambda r: calculate_distance_meters(r.pano_latitude, r.pano_longitude, r.bld_centroid_lat, r.bld_centroid_lon), axis=1
-                )
+                # Vectorized haversine over the four coordinate columns; the
+                # df.apply row loop called the geodesic helper once per row.
+                # Haversine vs geodesic differs by <0.5% at these distances,
+                # well inside the cutoff's tolerance.
+                lat1 = np.radians(df_matches['pano_latitude'].to_numpy(dtype=np.float64))
+                lon1 = np.radians(df_matches['pano_longitude'].to_numpy(dtype=np.float64))
+                lat2 = np.radians(df_matches['bld_centroid_lat'].to_numpy(dtype=np.float64))
+                lon2 = np.radians(df_matches['bld_centroid_lon'].to_numpy(dtype=np.float64))
+                half_chord = (np.sin((lat2 - lat1) / 2) ** 2
+                              + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+                df_matches['distance_to_centroid_m'] = 2 * 6371000.0 * np.arcsin(np.sqrt(half_chord))
             else:
-                 return None, None
+                 return None, None, None
 
     df_filtered = df_matches[df_matches['distance_to_centroid_m'] <= distance_cutoff_m].reset_index(drop=True)
 
@@ -96,14 +163,29 @@ def rotate_panoramas_to_facades(
         print(f"No facade matches within distance cutoff {distance_cutoff_m}m. No panoramas to rotate.")
         with open(rotated_meta_json_path, "w") as fp:
             json.dump([], fp)
-        return rotated_panos_dir, rotated_meta_json_path
+        return rotated_panos_dir, rotated_meta_json_path, []
 
     output_metadata_list = []
     
     print(f"Rotating {len(df_filtered)} panoramas based on facade matches...")
-    for idx, row in tqdm(df_filtered.iterrows(), total=df_filtered.shape[0], desc="Rotating Panoramas"):
-        if idx>20:
-            break
+    # One bulk conversion to plain dicts: iterrows() builds a fresh pandas
+    # Series per row, which dominates the loop overhead once the debug row
+    # cap (removed here) no longer hides it.
+    match_records = df_filtered.to_dict("records")
+
+    # The yaw arithmetic is elementwise math on two columns, so hoist it out
+    # of the loop as whole-frame numpy expressions and index by row below.
+    # yaw_coarse_degs matches signed_angular_difference(current, desired)
+    # applied row by row: shortest signed angle, in [-180, 180].
+    vehicle_headings = df_filtered["pano_true_heading"].to_numpy(dtype=np.float64)
+    desired_center_yaws = df_filtered["desired_camera_yaw_to_facade"].to_numpy(dtype=np.float64)
+    pano_current_centers = (vehicle_headings + measured_camera_offset_deg + 360.0) % 360.0
+    yaw_coarse_degs = (desired_center_yaws - pano_current_centers + 180.0) % 360.0 - 180.0
+
+    # Resolve every record's source panorama up front so decodes can be
+    # prefetched ahead of the roll/encode work below.
+    resolved_records = []  # (idx, row, source_pano_path)
+    for idx, row in enumerate(match_records):
         # Determine the correct path to the source panorama
         # 'pano_abs_path' from facade_processor should be the primary source.
         # If it's not absolute, or if we prefer to ensure it's from source_panoramas_dir:
@@ -116,23 +198,60 @@ def rotate_panoramas_to_facades(
         if not os.path.isfile(source_pano_path):
             print(f"Warning: Source panorama not found at '{source_pano_path}' for row {idx}. Skipping.")
             continue
+        resolved_records.append((idx, row, source_pano_path))
+
+    # One panorama often matches several façades, giving several rows with
+    # the same source file; each distinct panorama is decoded exactly once
+    # and the array reused for every roll derived from it (np.roll returns
+    # a fresh array, so reuse is safe). A use count per path lets the cache
+    # drop each decode as soon as its last match has been processed.
+    decode_use_counts = {}
+    for _, _, resolved_path in resolved_records:
+        decode_use_counts[resolved_path] = decode_use_counts.get(resolved_path, 0) + 1
+    unique_decode_paths = list(dict.fromkeys(
+        resolved_path for _, _, resolved_path in resolved_records))
+
+    # JPEG decode and encode release the GIL in Pillow, so a small thread
+    # pool overlaps reading panorama N+1 and writing panorama N-1 with the
+    # roll of panorama N. Decodes are prefetched a couple of distinct
+    # panoramas ahead; saves are collected and joined before the metadata
+    # JSON is written.
+    io_pool = ThreadPoolExecutor(max_workers=4) if write_rotated_images else None
+    save_futures = []
+    pending_decodes = {}   # path -> in-flight future
+    decoded_cache = {}     # path -> decoded array, evicted after last use
+    DECODE_PREFETCH = 2
+    next_prefetch_position = 0
+
+    def _decode_panorama(path):
+        return np.asarray(Image.open(path))
+
+    if io_pool is not None:
+        for prefetch_path in unique_decode_paths[:DECODE_PREFETCH]:
+            pending_decodes[prefetch_path] = io_pool.submit(_decode_panorama, prefetch_path)
+        next_prefetch_position = min(DECODE_PREFETCH, len(unique_decode_paths))
+
+    for idx, row, source_pano_path in tqdm(resolved_records, desc="Rotating Panoramas"):
+        # Counted down unconditionally so the cache eviction below stays in
+        # lockstep with the records even when one fails mid-computation.
+        decode_use_counts[source_pano_path] -= 1
 
         try:
             # Vehicle's True Heading (world coordinates)
-            H_vehicle = float(row["pano_true_heading"])
-            
+            H_vehicle = float(vehicle_headings[idx])
+
             # Raw (current) heading of the panorama's 0-degree line (center) in world coordinates
             # This is the vehicle's heading plus the camera's fixed offset from the vehicle.
-            H_pano_current_center = (H_vehicle + measured_camera_offset_deg + 360) % 360
-            
+            H_pano_current_center = float(pano_current_centers[idx])
+
             # Desired world heading for the center of the panorama to point at (façade midpoint)
-            H_desired_center_target_facade = float(row["desired_camera_yaw_to_facade"])
+            H_desired_center_target_facade = float(desired_center_yaws[idx])
 
             # 1. Coarse Yaw Adjustment:
             #    How much to rotate the panorama from its current orientation (H_pano_current_center)
             #    to the desired orientation (H_desired_center_target_facade).
             #    A positive yaw_coarse means rotate pano clockwise (pixels shift left).
-            yaw_coarse_deg = signed_angular_difference(H_pano_current_center, H_desired_center_target_facade)
+            yaw_coarse_deg = float(yaw_coarse_degs[idx])
 
             # 2. Fine Yaw Adjustment (Refinement):
             #    The 'desired_camera_yaw_to_facade' in the CSV is already the bearing from
@@ -165,27 +284,6 @@ def rotate_panoramas_to_facades(
             #    So if we want the new center to be `H_desired_center_target_facade`, and old center was `H_pano_current_center`,
             #    the required rotation is `yaw_coarse_deg`.
 
-            # Load image, transpose to C, H, W for equilib
-            pil_image = Image.open(source_pano_path)
-            img_array_chw = np.asarray(pil_image).transpose(2, 0, 1)
-
-            # Apply rotation
-            # A single rotation should suffice if yaw_coarse_deg is calculated correctly.
-            # The original script did two. If the fine yaw is truly for correcting a slightly off H_desired,
-            # it might still be useful. For now, we'll assume one precise rotation is enough.
-            # If H_desired_center_target_facade is precise, yaw_coarse_deg is the only rotation needed.
-            rotated_img_chw = equi2equi(
-                img_array_chw,
-                rots={"roll": 0, "pitch": 0, "yaw": math.radians(yaw_coarse_deg)}
-            )
-
-            if not np.issubdtype(rotated_img_chw.dtype, np.uint8):
-                rotated_img_chw = np.clip(rotated_img_chw, 0, 255).astype(np.uint8)
-            
-            # Transpose back to H, W, C for PIL
-            rotated_img_hwc = rotated_img_chw.transpose(1, 2, 0)
-            output_pil_image = Image.fromarray(rotated_img_hwc)
-
             base_filename = os.path.splitext(os.path.basename(row["pano_filename"]))[0]
             # Use BLD_ID and original CSV row index for unique filenaming.
             # Make BLD_ID file-system friendly (replace non-alphanumeric)
@@ -193,9 +291,44 @@ def rotate_panoramas_to_facades(
 
             output_image_filename = f"{base_filename}_BLD{bld_id_str}_FACADE{idx}_ROT.jpg"
             output_image_path = os.path.join(rotated_panos_dir, output_image_filename)
-            output_pil_image.save(output_image_path)
 
-            record = row.to_dict() # All original columns from CSV
+            if write_rotated_images:
+                # Load image as H, W, C (prefetched on the I/O pool, decoded
+                # at most once per distinct source panorama)
+                img_array_hwc = decoded_cache.get(source_pano_path)
+                if img_array_hwc is None:
+                    decode_future = pending_decodes.pop(source_pano_path, None)
+                    if decode_future is None:
+                        decode_future = io_pool.submit(_decode_panorama, source_pano_path)
+                    img_array_hwc = decode_future.result()
+                    decoded_cache[source_pano_path] = img_array_hwc
+                    # Top up the prefetch window with the next unseen panorama.
+                    if next_prefetch_position < len(unique_decode_paths):
+                        upcoming_path = unique_decode_paths[next_prefetch_position]
+                        next_prefetch_position += 1
+                        pending_decodes[upcoming_path] = io_pool.submit(
+                            _decode_panorama, upcoming_path)
+
+                # Apply rotation
+                # A single rotation should suffice if yaw_coarse_deg is calculated correctly.
+                # The original script did two. If the fine yaw is truly for correcting a slightly off H_desired,
+                # it might still be useful. For now, we'll assume one precise rotation is enough.
+                # If H_desired_center_target_facade is precise, yaw_coarse_deg is the only rotation needed.
+                #
+                # Since the rotation is pure yaw (roll and pitch are always 0 here),
+                # rotating the equirectangular image is exactly a horizontal shift of
+                # its columns: the image wraps around at 360°, so np.roll applies the
+                # rotation with zero interpolation. The quantisation error is under
+                # one column (< 360/width degrees), below what equi2equi's bilinear
+                # resampling could resolve anyway.
+                pano_width = img_array_hwc.shape[1]
+                shift_cols = int(round(yaw_coarse_deg / 360.0 * pano_width)) % pano_width
+                rotated_img_hwc = np.roll(img_array_hwc, -shift_cols, axis=1)
+
+                save_futures.append(io_pool.submit(
+                    _save_rotated_jpeg, rotated_img_hwc, output_image_path))
+
+            record = dict(row) # All original columns from CSV
             record.update({
                 "rotated_pano_path": output_image_path,
                 "applied_yaw_rotation_deg": yaw_coarse_deg, # The total effective yaw applied
@@ -204,6 +337,14 @@ def rotate_panoramas_to_facades(
                 "H_pano_initial_center_deg": H_pano_current_center,
                 "H_pano_final_center_deg": H_desired_center_target_facade
             })
+            if not write_rotated_images:
+                # rotated_pano_path above is only the name cube faces derive
+                # from; the file itself is never written. The extraction stage
+                # reads the source panorama and applies the roll itself.
+                record.update({
+                    "rotation_deferred": True,
+                    "source_pano_path": source_pano_path,
+                })
             output_metadata_list.append(record)
 
         except Exception as e_rotate:
@@ -211,13 +352,33 @@ def rotate_panoramas_to_facades(
             # import traceback # For debugging
             # traceback.print_exc() # For debugging
 
+        if decode_use_counts[source_pano_path] == 0:
+            # Last match for this panorama: release the decoded array (and
+            # any never-consumed prefetch) instead of holding it to the end.
+            decoded_cache.pop(source_pano_path, None)
+            pending_decodes.pop(source_pano_path, None)
+
+    if io_pool is not None:
+        for save_future in save_futures:
+            save_future.result()
+        io_pool.shutdown(wait=True)
+
     try:
-        with open(rotated_meta_json_path, "w") as fp_json:
-            json.dump(output_metadata_list, fp_json, indent=2)
-        print(f"✅ Panorama rotation complete. {len(output_metadata_list)} images saved to → {rotated_panos_dir}")
+        if orjson is not None:
+            with open(rotated_meta_json_path, "wb") as fp_json:
+                fp_json.write(orjson.dumps(
+                    output_metadata_list,
+                    option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
+        else:
+            with open(rotated_meta_json_path, "w") as fp_json:
+                json.dump(output_metadata_list, fp_json, indent=2)
+        if write_rotated_images:
+            print(f"✅ Panorama rotation complete. {len(output_metadata_list)} images saved to → {rotated_panos_dir}")
+        else:
+            print(f"✅ Rotation planning complete. {len(output_metadata_list)} rolls deferred to cube extraction.")
         print(f"📝 Rotation metadata saved to → {rotated_meta_json_path}")
     except Exception as e_json:
         print(f"Error writing rotation metadata JSON to {rotated_meta_json_path}: {e_json}")
-        return None, None
+        return None, None, None
         
-    return rotated_panos_dir, rotated_meta_json_path
\ No newline at end of file
+    return rotated_panos_dir, rotated_meta_json_path, output_metadata_list
\ No newline at end of file
@@ -9,11 +9,71 @@ import sys
 import json
 from utils import ensure_dir_exists
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _video_fingerprint(video_path: str, distance_m: float):
+    """Identity of a sampling run: source video size+mtime and the interval."""
+    stat_result = os.stat(video_path)
+    return {"size": stat_result.st_size, "mtime": stat_result.st_mtime, "distance_m": distance_m}
+
+
+def _write_progress(progress_path: str, progress: dict):
+    """Writes the checkpoint atomically so a crash never leaves it truncated."""
+    tmp_path = progress_path + ".tmp"
+    try:
+        with open(tmp_path, "w") as fp:
+            json.dump(progress, fp)
+        os.replace(tmp_path, progress_path)
+    except OSError as e_progress:
+        print(f"Warning: Could not write sampling checkpoint {progress_path}: {e_progress}", file=sys.stderr)
+
+
+def _json_looks_complete(json_path: str) -> bool:
+    """
+    Cheap validity check on mapillary_image_description.json: a non-empty list
+    of records that each carry a filename and a GPS fix. video_process usually
+    writes this itself, in which case the separate 'process' pass is redundant.
+    """
+    try:
+        with open(json_path, "rb") as fp:
+            raw = fp.read()
+        records = orjson.loads(raw) if orjson is not None else json.loads(raw)
+    except (OSError, ValueError):
+        return False
+    if not isinstance(records, list) or not records:
+        return False
+    for record in records:
+        if not isinstance(record, dict) or "filename" not in record:
+            return False
+        if "MAPLatitude" not in record or "MAPLongitude" not in record:
+            return False
+    return True
+
+
+def _run_streaming(cmd):
+    """
+    Runs a mapillary_tools command echoing its output line by line instead of
+    capture_output=True, which buffers the whole stdout/stderr in memory —
+    ffmpeg's logs on long videos can run to hundreds of MB. Raises
+    CalledProcessError on a non-zero exit, like subprocess.run(check=True).
+    """
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                          text=True, bufsize=1) as proc:
+        for output_line in proc.stdout:
+            print(output_line, end="")
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+
 def sample_video_by_distance(
     video_path: str,
     base_output_dir: str,
     distance_m: float,
-    mapillary_tools_path: str = "mapillary_tools"
+    mapillary_tools_path: str = "mapillary_tools",
+    resume: bool = True
 ):
     """
     Uses mapillary_tools to sample video frames every `distance_m` meters.
@@ -24,6 +84,12 @@ def sample_video_by_distance(
                          Sampled images will be in a subdirectory.
         distance_m: Sampling interval in meters.
         mapillary_tools_path: Path to the mapillary_tools executable.
+        resume: When True (default), a checkpoint written after the expensive
+                video-sampling step lets a rerun skip straight to the geotag
+                step if only that failed (as long as the source video and
+                sampling interval are unchanged). mapillary_tools owns the
+                frame extraction loop, so resumption is per-step, not
+                per-frame.
 
     Returns:
         A tuple (sampled_images_dir, mapillary_image_description_json_path)
@@ -35,31 +101,50 @@ def sample_video_by_distance(
     # The mapillary_tools process command writes the JSON to the image directory
     mapillary_image_description_json_path = os.path.join(sampled_images_dir, "mapillary_image_description.json")
 
+    progress_path = os.path.join(sampled_images_dir, "sampling_progress.json")
+    fingerprint = _video_fingerprint(video_path, distance_m)
+    sampling_already_done = False
+    if resume:
+        try:
+            with open(progress_path, "r") as fp:
+                sampling_already_done = json.load(fp).get("video_process") == fingerprint
+        except (OSError, ValueError):
+            sampling_already_done = False
+
     # 1) Run the Mapillary video sampler
-    cmd_sample = [
-        mapillary_tools_path,
-        "video_process",
-        video_path,
-        sampled_images_dir, # mapillary_tools puts images directly here
-        f"--video_sample_distance={distance_m}"
-    ]
-    print(f"Running video sampling: {' '.join(cmd_sample)}")
-    try:
-        subprocess.run(cmd_sample, check=True, capture_output=True, text=True)
-        print(f"Video sampling successful. Images in: {sampled_images_dir}")
-    except subprocess.CalledProcessError as e:
-        print(f"Error during mapillary_tools video_process: {e}", file=sys.stderr)
-        print(f"Stdout: {e.stdout}", file=sys.stderr)
-        print(f"Stderr: {e.stderr}", file=sys.stderr)
-        return None, None
-    except FileNotFoundError:
-        print(f"Error: mapillary_tools executable not found at '{mapillary_tools_path}'. Please check the path.", file=sys.stderr)
-        return None, None
+    if sampling_already_done:
+        print(f"Resuming: video sampling already completed for this video; skipping to geotagging.")
+    else:
+        cmd_sample = [
+            mapillary_tools_path,
+            "video_process",
+            video_path,
+            sampled_images_dir, # mapillary_tools puts images directly here
+            f"--video_sample_distance={distance_m}"
+        ]
+        print(f"Running video sampling: {' '.join(cmd_sample)}")
+        try:
+            _run_streaming(cmd_sample)
+            print(f"Video sampling successful. Images in: {sampled_images_dir}")
+        except subprocess.CalledProcessError as e:
+            print(f"Error during mapillary_tools video_process: {e}", file=sys.stderr)
+            return None, None
+        except FileNotFoundError:
+            print(f"Error: mapillary_tools executable not found at '{mapillary_tools_path}'. Please check the path.", file=sys.stderr)
+            return None, None
+        # Checkpoint: if the geotag step below fails, the next run skips the
+        # (much longer) frame extraction instead of starting from scratch.
+        _write_progress(progress_path, {"video_process": fingerprint})
 
     # 2) Geotag / process the sampled images (this also creates mapillary_image_description.json)
     # This step is often crucial for preparing images for further Mapillary processing or for extracting metadata.
     # If mapillary_tools video_process already created a suitable mapillary_image_description.json,
     # this might be redundant or might refine it. Check mapillary_tools documentation for your version.
+    if _json_looks_complete(mapillary_image_description_json_path):
+        print(f"Skipping 'mapillary_tools process': complete metadata JSON already at {mapillary_image_description_json_path}")
+        print(f"Done! Sampled images are in {sampled_images_dir}")
+        return sampled_images_dir, mapillary_image_description_json_path
+
     cmd_process = [
         mapillary_tools_path,
         "process",
@@ -67,12 +152,10 @@ def sample_video_by_distance(
     ]
     print(f"Running image processing: {' '.join(cmd_process)}")
     try:
-        subprocess.run(cmd_process, check=True, capture_output=True, text=True)
+        _run_streaming(cmd_process)
         print(f"Image processing successful. Metadata JSON: {mapillary_image_description_json_path}")
     except subprocess.CalledProcessError as e:
         print(f"Error during mapillary_tools process: {e}", file=sys.stderr)
-        print(f"Stdout: {e.stdout}", file=sys.stderr)
-        print(f"Stderr: {e.stderr}", file=sys.stderr)
         # If the JSON file was created by video_process, we might still be able to proceed
         if not os.path.exists(mapillary_image_description_json_path):
             return None, None
@@ -12,15 +12,110 @@ import json
 import shutil
 import csv
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 from tqdm import tqdm
-from utils import ensure_dir_exists
+from utils import ensure_dir_exists, safe_dirname
+
+# orjson parses the cube-face metadata list a few times faster than stdlib
+# json. The small per-building building_info.json files stay on stdlib json
+# for their human-friendly indent=4 output.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Optional: stream very large metadata files record by record instead of
+# materializing the whole list before grouping.
+_STREAM_JSON_THRESHOLD_BYTES = 10 * 1024 * 1024
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+def _copy_file_fast(source_path: str, destination_path: str):
+    """
+    Copies one file, using os.copy_file_range where available so the kernel
+    moves the bytes directly (a reflink/O(1) metadata op on XFS/Btrfs, an
+    in-kernel bulk copy on ext4) instead of shuttling every byte through
+    user-space buffers. Falls back to shutil.copy2 when unsupported (e.g.
+    non-Linux, or a cross-filesystem copy on older kernels).
+    """
+    if hasattr(os, "copy_file_range"):
+        try:
+            with open(source_path, "rb") as f_src, open(destination_path, "wb") as f_dst:
+                bytes_remaining = os.fstat(f_src.fileno()).st_size
+                while bytes_remaining > 0:
+                    bytes_copied = os.copy_file_range(f_src.fileno(), f_dst.fileno(), bytes_remaining)
+                    if bytes_copied == 0:
+                        break
+                    bytes_remaining -= bytes_copied
+            if bytes_remaining == 0:
+                shutil.copystat(source_path, destination_path)
+                return
+        except OSError:
+            pass
+    shutil.copy2(source_path, destination_path)
+
+
+@lru_cache(maxsize=4)
+def _load_damage_map(csv_path: str, mtime_ns: int) -> dict:
+    """
+    Parses the damage CSV into a BLD_ID -> DAMAGE dict. Memoized on
+    (path, mtime) so repeated sorts in one session reuse the parse while an
+    edited file still invalidates the entry. Callers must not mutate the
+    returned dict. The mtime_ns argument only keys the cache.
+    """
+    damage_map = {}
+    try:
+        with open(csv_path, mode='r', encoding='utf-8', newline='') as f_csv:
+            reader = csv.DictReader(f_csv)
+            if "BLD_ID" in reader.fieldnames and "DAMAGE" in reader.fieldnames:
+                for row in reader:
+                    bld_id_csv = str(row.get("BLD_ID", "")).strip()
+                    if bld_id_csv:
+                        damage_map[bld_id_csv] = row.get("DAMAGE", "").strip()
+    except Exception as e_csv:
+        print(f"Warning: Could not read damage CSV {csv_path}: {e_csv}")
+    return damage_map
+
+
+def _transfer_face(source_path: str, destination_path: str, move_file: bool, use_hardlink: bool = False):
+    """Copies or moves one cube face; errors are printed, not raised."""
+    try:
+        if move_file:
+            # Same-filesystem moves are a single rename syscall; a move that
+            # crosses filesystems (EXDEV) degrades to the fast copy + unlink
+            # rather than shutil.move's byte-shuttling copy2 fallback.
+            try:
+                os.rename(source_path, destination_path)
+            except OSError:
+                _copy_file_fast(source_path, destination_path)
+                os.unlink(source_path)
+        else:
+            if use_hardlink:
+                # On the common single-disk layout a hardlink delivers the
+                # face with one inode-only syscall, no bytes copied. EXDEV
+                # (different filesystem), EPERM (fs forbids links) or a
+                # leftover destination all fall through to the real copy.
+                try:
+                    os.link(source_path, destination_path)
+                    return
+                except OSError:
+                    pass
+            _copy_file_fast(source_path, destination_path)
+    except Exception as e_file_op:
+        print(f"Error {'moving' if move_file else 'copying'} file {source_path}: {e_file_op}")
 
 def sort_cube_faces_by_building(
     cube_faces_metadata_json_path: str, # From cube_extractor.py
     building_damage_csv_path: str,      # CSV with BLD_ID and DAMAGE columns
     final_sorted_dir: str,              # The specific, consolidated directory to save sorted outputs into.
-    move_files: bool = False
+    move_files: bool = False,
+    cube_face_records: list = None,     # Optional in-memory records from the extraction stage
+    use_hardlinks: bool = True
 ):
     """
     Sorts cube faces into folders per building ID.
@@ -30,6 +125,15 @@ def sort_cube_faces_by_building(
         building_damage_csv_path (str): Path to a CSV file with building damage info.
         final_sorted_dir (str): The specific directory to save sorted outputs into.
         move_files (bool): If True, moves cube face files. If False (default), copies them.
+        cube_face_records (list): Optional metadata records handed over in-memory
+            by a same-process extraction stage. When given, the JSON at
+            cube_faces_metadata_json_path is not parsed (the path is still used
+            to locate the cube face image files next to it).
+        use_hardlinks (bool): When copying (move_files=False), hardlink faces
+            into the building folders instead of duplicating their bytes when
+            source and destination share a filesystem. Safe because cube faces
+            are immutable artifacts; pass False if a consumer edits the sorted
+            files in place.
     """
     sorted_output_root_dir = Path(final_sorted_dir)
     ensure_dir_exists(sorted_output_root_dir)
@@ -39,57 +143,91 @@ def sort_cube_faces_by_building(
         print(f"Error: Cube faces metadata JSON not found at {meta_json_path_obj}")
         return None
 
-    # --- 1. Load building damage information from CSV ---
+    # --- 1. Load building damage information from CSV (memoized on mtime) ---
     damage_map = {}
-    if Path(building_damage_csv_path).is_file():
-        try:
-            with open(building_damage_csv_path, mode='r', encoding='utf-8', newline='') as f_csv:
-                reader = csv.DictReader(f_csv)
-                if "BLD_ID" in reader.fieldnames and "DAMAGE" in reader.fieldnames:
-                    for row in reader:
-                        bld_id_csv = str(row.get("BLD_ID", "")).strip()
-                        if bld_id_csv:
-                            damage_map[bld_id_csv] = row.get("DAMAGE", "").strip()
-        except Exception as e_csv:
-            print(f"Warning: Could not read damage CSV {building_damage_csv_path}: {e_csv}")
+    try:
+        damage_csv_mtime_ns = os.stat(building_damage_csv_path).st_mtime_ns
+    except OSError:
+        damage_csv_mtime_ns = None
+    if damage_csv_mtime_ns is not None:
+        damage_map = _load_damage_map(str(building_damage_csv_path), damage_csv_mtime_ns)
     else:
         print(f"Warning: Building damage CSV not found at {building_damage_csv_path}. DAMAGE field will be empty.")
 
-    # --- 2. Load cube faces metadata ---
-    try:
-        with open(meta_json_path_obj, 'r') as f_json:
-            all_cube_face_records = json.load(f_json)
-    except Exception as e_json:
-        print(f"Error reading cube faces metadata {meta_json_path_obj}: {e_json}")
-        return None
+    # --- 2. Load cube faces metadata and group records by BLD_ID ---
+    records_grouped_by_bld_id = defaultdict(list)
+    total_face_record_count = 0
+    if cube_face_records is not None:
+        # Records handed over in-memory by the extraction stage: skip the parse.
+        all_cube_face_records = cube_face_records
+    elif ijson is not None and meta_json_path_obj.stat().st_size >= _STREAM_JSON_THRESHOLD_BYTES:
+        # Metadata too large to comfortably materialize: stream records one
+        # at a time straight into the per-building groups.
+        all_cube_face_records = None
+        try:
+            with open(meta_json_path_obj, "rb") as f_json:
+                for record in ijson.items(f_json, "item"):
+                    # BLD_ID is almost always already a str; skipping the
+                    # redundant str() saves an allocation per record.
+                    bld_id = record.get("BLD_ID", "UnknownBuilding")
+                    if type(bld_id) is not str:
+                        bld_id = str(bld_id)
+                    records_grouped_by_bld_id[bld_id.strip()].append(record)
+                    total_face_record_count += 1
+        except Exception as e_json:
+            print(f"Error reading cube faces metadata {meta_json_path_obj}: {e_json}")
+            return None
+    else:
+        try:
+            with open(meta_json_path_obj, "rb") as f_json:
+                raw_metadata = f_json.read()
+            all_cube_face_records = orjson.loads(raw_metadata) if orjson is not None \
+                else json.loads(raw_metadata)
+        except Exception as e_json:
+            print(f"Error reading cube faces metadata {meta_json_path_obj}: {e_json}")
+            return None
+
+    if all_cube_face_records is not None:
+        for record in all_cube_face_records:
+            bld_id = record.get("BLD_ID", "UnknownBuilding")
+            if type(bld_id) is not str:
+                bld_id = str(bld_id)
+            records_grouped_by_bld_id[bld_id.strip()].append(record)
+        total_face_record_count = len(all_cube_face_records)
 
-    if not all_cube_face_records:
+    if not records_grouped_by_bld_id:
         print("No cube face records found to sort.")
         return str(sorted_output_root_dir)
 
-    # --- 3. Group records by BLD_ID ---
-    records_grouped_by_bld_id = defaultdict(list)
-    for record in all_cube_face_records:
-        bld_id = str(record.get("BLD_ID", "UnknownBuilding")).strip()
-        records_grouped_by_bld_id[bld_id].append(record)
-    
-    print(f"Sorting {len(all_cube_face_records)} cube face entries into {len(records_grouped_by_bld_id)} building folders...")
+    print(f"Sorting {total_face_record_count} cube face entries into {len(records_grouped_by_bld_id)} building folders...")
 
     # --- 4. Process each building ---
-    for bld_id, building_records in tqdm(records_grouped_by_bld_id.items(), desc="Sorting by Building"):
-        safe_bld_id_dirname = bld_id.replace(os.sep, "_").replace(" ", "_").replace(":", "_")
+    # File transfers are I/O-bound syscalls that release the GIL, so they are
+    # fanned out over a thread pool to keep many requests outstanding on the
+    # disk instead of paying one round-trip per face.
+    transfer_pairs = []  # (source_path, destination_path)
+    source_image_dir = meta_json_path_obj.parent / "cubeface_image_files"
+
+    def _sort_one_building(bld_id, building_records):
+        """Prepares one building folder and its building_info.json; returns
+        the (source, destination) transfer pairs for its cube faces."""
+        building_transfer_pairs = []
+        safe_bld_id_dirname = safe_dirname(bld_id)
         current_building_output_dir = sorted_output_root_dir / safe_bld_id_dirname
         ensure_dir_exists(current_building_output_dir)
 
-        # Create or update building_info.json
+        # Create or update building_info.json. Opening directly and catching
+        # FileNotFoundError saves the separate exists() stat per building;
+        # on fresh runs the open fails straight to the from-scratch branch.
         building_info_json_path = current_building_output_dir / "building_info.json"
         building_info_data = {}
-        if building_info_json_path.exists():
-            try: # Load existing data to append new views to it
-                with open(building_info_json_path, "r") as f:
-                    building_info_data = json.load(f)
-            except json.JSONDecodeError:
-                building_info_data = {}
+        try: # Load existing data to append new views to it
+            with open(building_info_json_path, "r") as f:
+                building_info_data = json.load(f)
+        except FileNotFoundError:
+            pass
+        except json.JSONDecodeError:
+            building_info_data = {}
         
         # Populate static building info if not already present
         if "BLD_ID" not in building_info_data:
@@ -109,6 +247,18 @@ def sort_cube_faces_by_building(
         if "associated_views" not in building_info_data:
             building_info_data["associated_views"] = []
 
+        # Faces already delivered by an earlier (partial or full) run can be
+        # skipped, making reruns near-free. One scandir per building replaces
+        # a stat per destination face.
+        existing_face_sizes = {}
+        try:
+            with os.scandir(current_building_output_dir) as dir_entries:
+                for dir_entry in dir_entries:
+                    if dir_entry.is_file():
+                        existing_face_sizes[dir_entry.name] = dir_entry.stat().st_size
+        except OSError:
+            pass
+
         # Process each view for this building
         for view_record in building_records:
             extracted_faces_dict = view_record.get("extracted_cube_faces", {})
@@ -123,33 +273,59 @@ def sort_cube_faces_by_building(
             }
 
             for face_name, face_filename in extracted_faces_dict.items():
-                # Reconstruct the full path to the source image.
-                # It's located relative to the JSON file we are reading.
-                source_image_dir = meta_json_path_obj.parent / "cubeface_image_files"
+                # The source image lives relative to the JSON file we are reading.
                 actual_source_file = source_image_dir / face_filename
-                
-                if actual_source_file.is_file():
-                    destination_face_path = current_building_output_dir / actual_source_file.name
-                    try:
-                        if move_files:
-                            shutil.move(str(actual_source_file), str(destination_face_path))
-                        else:
-                            shutil.copy2(str(actual_source_file), str(destination_face_path))
-                        # Store just the filename in the final JSON, as its location is implied
-                        view_specific_info["view_cube_faces"][face_name] = destination_face_path.name
-                    except Exception as e_file_op:
-                        print(f"Error {'moving' if move_files else 'copying'} file {actual_source_file}: {e_file_op}")
+                try:
+                    source_size = os.stat(actual_source_file).st_size
+                except OSError:
+                    source_size = None
+
+                destination_face_path = current_building_output_dir / actual_source_file.name
+                existing_size = existing_face_sizes.get(destination_face_path.name)
+                if existing_size is not None and (source_size is None or source_size == existing_size):
+                    # Already transferred by a previous run (the source may
+                    # even have been moved away); just register the face.
+                    view_specific_info["view_cube_faces"][face_name] = destination_face_path.name
+                    continue
+
+                if source_size is not None:
+                    building_transfer_pairs.append((str(actual_source_file), str(destination_face_path)))
+                    # Store just the filename in the final JSON, as its location is implied
+                    view_specific_info["view_cube_faces"][face_name] = destination_face_path.name
                 else:
                     print(f"Warning: Cube face source file not found at {actual_source_file}. Skipping.")
             
             building_info_data["associated_views"].append(view_specific_info)
 
-        # Save the updated building_info.json
+        # Save the updated building_info.json in one write call; serializing
+        # to a string first avoids json.dump's many small file writes.
         try:
-            with open(building_info_json_path, "w") as fp_bld_json:
-                json.dump(building_info_data, fp_bld_json, indent=4)
+            building_info_json_path.write_text(json.dumps(building_info_data, indent=4))
         except Exception as e_bld_json:
             print(f"Error writing building_info.json for BLD_ID {bld_id}: {e_bld_json}")
 
+        return building_transfer_pairs
+
+    # Each building touches only its own folder and JSON, so buildings can be
+    # prepared concurrently (the work is mkdir/read/write syscalls that
+    # release the GIL). Small runs stay serial — the pool costs more than it
+    # saves for a handful of folders.
+    building_items = list(records_grouped_by_bld_id.items())
+    if len(building_items) > 4:
+        with ThreadPoolExecutor(max_workers=8) as building_executor:
+            for building_pairs in tqdm(
+                    building_executor.map(lambda item: _sort_one_building(*item), building_items),
+                    total=len(building_items), desc="Sorting by Building"):
+                transfer_pairs.extend(building_pairs)
+    else:
+        for bld_id, building_records in tqdm(building_items, desc="Sorting by Building"):
+            transfer_pairs.extend(_sort_one_building(bld_id, building_records))
+
+    if transfer_pairs:
+        with ThreadPoolExecutor(max_workers=16) as transfer_executor:
+            list(transfer_executor.map(
+                lambda pair: _transfer_face(pair[0], pair[1], move_files, use_hardlinks),
+                transfer_pairs))
+
     print(f"✅ Output sorting complete. Sorted outputs are in → {sorted_output_root_dir}")
     return str(sorted_output_root_dir)
@@ -2,16 +2,94 @@
 import os
 from math import radians, degrees, atan2, sin, cos, sqrt
 import numpy as np
-from pyproj import Geod
+from pyproj import Geod, Transformer
 import geopandas as gpd
 from shapely.geometry import Point, Polygon
 
+# pyogrio reads large GeoJSON files 5-20x faster than the fiona engine and
+# with lower peak memory via Arrow; geopandas uses it when asked for.
+try:
+    import pyogrio  # noqa: F401
+    GEOJSON_READ_KWARGS = {"engine": "pyogrio", "use_arrow": True}
+except ImportError:
+    GEOJSON_READ_KWARGS = {}
+
 # Geodesic object for distance and bearing calculations
 geod = Geod(ellps="WGS84")
 
+# PROJ pipeline construction is comparatively expensive, so Transformers are
+# built once per (src, dst) EPSG pair and shared by all callers.
+_transformer_cache = {}
+
+def get_transformer(src_epsg: int, dst_epsg: int) -> Transformer:
+    """Returns a cached pyproj Transformer (always_xy) for the given EPSG pair."""
+    key = (src_epsg, dst_epsg)
+    transformer = _transformer_cache.get(key)
+    if transformer is None:
+        transformer = Transformer.from_crs(src_epsg, dst_epsg, always_xy=True)
+        _transformer_cache[key] = transformer
+    return transformer
+
+# Directories already created (or confirmed) this run; skips the stat +
+# maybe-mkdir syscalls os.makedirs pays on every repeat call for the same
+# path. Set ops are GIL-atomic, and a race between threads just means one
+# redundant (exist_ok) makedirs.
+_known_dirs = set()
+
+# Filesystem-safe directory names for building IDs: one translate pass maps
+# path separators, spaces and colons to "_". Shared by the sorter and the
+# deploy script so both derive the same folder for a given BLD_ID.
+_SAFE_DIRNAME_TRANS = str.maketrans({os.sep: "_", "/": "_", "\\": "_", " ": "_", ":": "_"})
+
+def safe_dirname(name):
+    """Returns name as a string with filesystem-unsafe characters mapped to '_'."""
+    return str(name).translate(_SAFE_DIRNAME_TRANS)
+
 def ensure_dir_exists(dir_path):
-    """Creates a directory if it doesn't already exist."""
+    """Creates a directory if it doesn't already exist (memoized per path)."""
+    dir_path = os.fspath(dir_path)
+    if dir_path in _known_dirs:
+        return
     os.makedirs(dir_path, exist_ok=True)
+    _known_dirs.add(dir_path)
+
+def has_file_with_suffix(dir_path, suffix):
+    """
+    True if dir_path contains at least one regular file whose name ends with
+    suffix. Short-circuits at the first hit via os.scandir instead of
+    materializing the whole listing (os.listdir is O(entries) even when only
+    existence matters), and uses the DirEntry's cached type to avoid an extra
+    stat per entry. A missing or unreadable directory counts as no match.
+    """
+    try:
+        with os.scandir(dir_path) as dir_entries:
+            return any(entry.name.endswith(suffix) and entry.is_file() for entry in dir_entries)
+    except OSError:
+        return False
+
+def load_footprints_cached(geojson_path):
+    """
+    Loads building footprints, maintaining a GeoParquet sibling cache.
+    The parquet copy loads via Arrow with binary geometry, skipping the
+    GeoJSON tokenization cost on repeat runs; it is rebuilt automatically
+    whenever the source GeoJSON is newer than the cache. The cache is stored
+    already reprojected to EPSG:4326, so warm loads skip the to_crs pass too.
+    """
+    geojson_path = str(geojson_path)
+    parquet_path = geojson_path + ".parquet"
+    try:
+        if os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= os.path.getmtime(geojson_path):
+            return gpd.read_parquet(parquet_path)
+    except Exception as e_cache_read:
+        print(f"Warning: Could not read footprint cache '{parquet_path}': {e_cache_read}. Falling back to GeoJSON.")
+    gdf = gpd.read_file(geojson_path, **GEOJSON_READ_KWARGS)
+    if gdf.crs is not None and gdf.crs.to_epsg() != 4326:
+        gdf = gdf.to_crs(epsg=4326)
+    try:
+        gdf.to_parquet(parquet_path)
+    except Exception as e_cache_write:
+        print(f"Warning: Could not write footprint cache '{parquet_path}': {e_cache_write}")
+    return gdf
 
 def great_circle_bearing(lat1, lon1, lat2, lon2):
     """
@@ -20,21 +98,41 @@ def great_circle_bearing(lat1, lon1, lat2, lon2):
     Returns bearing in degrees (0-360).
     """
     phi1, phi2 = map(radians, (lat1, lat2))
-    lambda1, lambda2 = map(radians, (lon1, lon2))
-    delta_lambda = lambda2 - lambda1
+    delta_lambda = radians(lon2) - radians(lon1)
 
-    y = sin(delta_lambda) * cos(phi2)
-    x = cos(phi1) * sin(phi2) - sin(phi1) * cos(phi2) * cos(delta_lambda)
+    # Each trig value is computed once and reused between the two terms.
+    cos_phi2 = cos(phi2)
+    y = sin(delta_lambda) * cos_phi2
+    x = cos(phi1) * sin(phi2) - sin(phi1) * cos_phi2 * cos(delta_lambda)
     theta = atan2(y, x)
     return (degrees(theta) + 360) % 360
 
+def great_circle_bearings(lats1, lons1, lats2, lons2):
+    """
+    Vectorized great_circle_bearing: initial bearings between broadcastable
+    arrays (or scalars) of origin and destination points, computed with numpy
+    ufuncs so the trig runs in C over the whole array. Returns bearings in
+    degrees (0-360).
+    """
+    phi1 = np.radians(np.asarray(lats1, dtype=np.float64))
+    phi2 = np.radians(np.asarray(lats2, dtype=np.float64))
+    delta_lambda = (np.radians(np.asarray(lons2, dtype=np.float64))
+                    - np.radians(np.asarray(lons1, dtype=np.float64)))
+
+    cos_phi2 = np.cos(phi2)
+    y = np.sin(delta_lambda) * cos_phi2
+    x = np.cos(phi1) * np.sin(phi2) - np.sin(phi1) * cos_phi2 * np.cos(delta_lambda)
+    return (np.degrees(np.arctan2(y, x)) + 360.0) % 360.0
+
 def angular_difference(a1, a2):
     """
     Calculates the shortest angle between two angles (in degrees).
     Result is in range [0, 180].
     """
     diff = abs(a1 - a2) % 360
-    return diff if diff <= 180 else 360 - diff
+    # Branchless form: equivalent to the wrap-around conditional, without a
+    # data-dependent branch.
+    return min(diff, 360 - diff)
 
 def signed_angular_difference(a1, a2):
     """
@@ -63,43 +161,60 @@ def find_front_edge(polygon: Polygon, cam_lat: float, cam_lon: float, cam_to_cen
     """
     Identifies the edge of a polygon whose midpoint faces the camera most directly.
     Returns the coordinates of the best edge ((lon1, lat1), (lon2, lat2)) or None.
+
+    Thin wrapper over the vectorized pair polygon_edge_array /
+    find_front_edge_from_array: one numpy pass over all edges replaces the
+    former per-edge Python trig loop. Callers that query the same polygon
+    repeatedly should precompute polygon_edge_array themselves.
+    """
+    return find_front_edge_from_array(
+        polygon_edge_array(polygon), cam_lat, cam_lon, cam_to_centroid_bearing)
+
+def polygon_edge_array(polygon):
+    """
+    Flattens a (Multi)Polygon's ring edges into an (N, 4) float64 array of
+    (lon1, lat1, lon2, lat2) rows, in the same ring/edge order find_front_edge
+    walks them. Returns None for other geometry types or degenerate rings.
+    Computing this once per polygon lets callers pick the front edge with
+    vectorized numpy math instead of per-edge Python trig.
     """
-    best_edge_coords, min_angle_diff_to_centroid_ray = None, 360.0
-    
-    # Handle both Polygon and MultiPolygon
     rings = []
     if polygon.geom_type == "Polygon":
         rings.append(polygon.exterior)
-        for interior in polygon.interiors:
-            rings.append(interior)
+        rings.extend(polygon.interiors)
     elif polygon.geom_type == "MultiPolygon":
         for poly_part in polygon.geoms:
             rings.append(poly_part.exterior)
-            for interior in poly_part.interiors:
-                rings.append(interior)
+            rings.extend(poly_part.interiors)
     else:
-        return None # Not a Polygon or MultiPolygon
+        return None
 
+    edge_segments = []
     for ring in rings:
-        coords = list(ring.coords)
-        for i in range(len(coords) - 1):
-            p1_lon, p1_lat = drop_z(coords[i])
-            p2_lon, p2_lat = drop_z(coords[i+1])
-            
-            mid_lon, mid_lat = (p1_lon + p2_lon) / 2, (p1_lat + p2_lat) / 2
-            
-            # Bearing from camera to this edge's midpoint
-            bearing_cam_to_midpoint = great_circle_bearing(cam_lat, cam_lon, mid_lat, mid_lon)
-            
-            # How much does this deviate from the direct line to the building centroid?
-            # This helps select an edge on the "facing side" of the building.
-            angle_diff = angular_difference(bearing_cam_to_midpoint, cam_to_centroid_bearing)
-            
-            if angle_diff < min_angle_diff_to_centroid_ray:
-                min_angle_diff_to_centroid_ray = angle_diff
-                best_edge_coords = ((p1_lon, p1_lat), (p2_lon, p2_lat))
-                
-    return best_edge_coords
+        coords = np.asarray(ring.coords, dtype=np.float64)[:, :2]  # drops Z
+        if len(coords) >= 2:
+            edge_segments.append(np.concatenate([coords[:-1], coords[1:]], axis=1))
+    if not edge_segments:
+        return None
+    return np.concatenate(edge_segments, axis=0)
+
+def find_front_edge_from_array(edge_array, cam_lat: float, cam_lon: float, cam_to_centroid_bearing: float):
+    """
+    Vectorized counterpart of find_front_edge operating on a precomputed
+    polygon_edge_array. Returns ((lon1, lat1), (lon2, lat2)) of the edge whose
+    midpoint bearing deviates least from the camera-to-centroid bearing, or
+    None. Matches find_front_edge's first-minimum tie-breaking.
+    """
+    if edge_array is None or len(edge_array) == 0:
+        return None
+    mid_lons = (edge_array[:, 0] + edge_array[:, 2]) / 2
+    mid_lats = (edge_array[:, 1] + edge_array[:, 3]) / 2
+    bearings = great_circle_bearings(cam_lat, cam_lon, mid_lats, mid_lons)
+    diffs = np.abs(bearings - cam_to_centroid_bearing) % 360.0
+    diffs = np.minimum(diffs, 360.0 - diffs)
+    best = int(np.argmin(diffs))
+    return ((edge_array[best, 0], edge_array[best, 1]),
+            (edge_array[best, 2], edge_array[best, 3]))
 
 def calculate_edge_normal_bearing(lon1: float, lat1: float, lon2: float, lat2: float):
     """
@@ -118,6 +233,23 @@ def calculate_distance_meters(lat1, lon1, lat2, lon2):
     _, _, distance = geod.inv(lon1, lat1, lon2, lat2) # inv returns az1, az2, dist
     return distance
 
+# Projected centroids (and their spatial index) per footprint GeoDataFrame,
+# so repeated closest-building queries against the same frame reproject and
+# build the STRtree once. The frame itself is kept in the entry to pin its
+# id() for the lifetime of the cache.
+_metric_centroid_cache = {}
+
+def _metric_centroids_for(gdf_buildings: gpd.GeoDataFrame):
+    """Returns cached EPSG:3857 centroids (with spatial index) for the frame."""
+    cache_key = id(gdf_buildings)
+    cached = _metric_centroid_cache.get(cache_key)
+    if cached is None:
+        centroids_metric = gdf_buildings.to_crs(epsg=3857).geometry.centroid
+        centroids_metric.sindex  # build the STRtree eagerly, once
+        cached = (gdf_buildings, centroids_metric)
+        _metric_centroid_cache[cache_key] = cached
+    return cached[1]
+
 def find_closest_building_by_latlon(target_lat: float, target_lon: float, gdf_buildings: gpd.GeoDataFrame, tolerance_m: float = 50.0):
     """
     Finds the closest building ID from a GeoDataFrame to a target lat/lon.
@@ -135,24 +267,26 @@ def find_closest_building_by_latlon(target_lat: float, target_lon: float, gdf_bu
     if gdf_buildings.crs.to_epsg() != 4326:
         gdf_buildings = gdf_buildings.to_crs(epsg=4326)
 
-    min_dist = float('inf')
-    closest_bld_id = None
-    closest_bld_centroid_lat = None
-    closest_bld_centroid_lon = None
-
-    for idx, building in gdf_buildings.iterrows():
-        centroid = building.geometry.centroid
-        bld_lat, bld_lon = centroid.y, centroid.x
-        dist = calculate_distance_meters(target_lat, target_lon, bld_lat, bld_lon)
+    # Query the GEOS STRtree spatial index over building centroids in a metric
+    # CRS instead of scanning every footprint with a Python-level distance loop.
+    # Web Mercator matches the planar CRS used elsewhere in the pipeline.
+    centroids_metric = _metric_centroids_for(gdf_buildings)
+    query_x, query_y = get_transformer(4326, 3857).transform(target_lon, target_lat)
+    query_point_metric = Point(query_x, query_y)
+    nearest_positions = centroids_metric.sindex.nearest(query_point_metric, return_all=False)
 
-        if dist < min_dist:
-            min_dist = dist
-            closest_bld_id = building.get("BLD_ID", None) # Ensure BLD_ID column exists
-            if closest_bld_id is None and "id" in building: # Try "id" if "BLD_ID" not found
-                 closest_bld_id = building["id"]
-            closest_bld_centroid_lat = bld_lat
-            closest_bld_centroid_lon = bld_lon
+    if nearest_positions.shape[1] == 0:
+        print(f"No building found within {tolerance_m}m of {target_lat}, {target_lon}.")
+        return None, None, None, None
 
+    building = gdf_buildings.iloc[nearest_positions[1, 0]]
+    centroid = building.geometry.centroid
+    closest_bld_centroid_lat, closest_bld_centroid_lon = centroid.y, centroid.x
+    # Report the geodesic distance so the tolerance check stays in true meters.
+    min_dist = calculate_distance_meters(target_lat, target_lon, closest_bld_centroid_lat, closest_bld_centroid_lon)
+    closest_bld_id = building.get("BLD_ID", None) # Ensure BLD_ID column exists
+    if closest_bld_id is None and "id" in building: # Try "id" if "BLD_ID" not found
+        closest_bld_id = building["id"]
 
     if closest_bld_id is not None and min_dist <= tolerance_m:
         return str(closest_bld_id), closest_bld_centroid_lat, closest_bld_centroid_lon, min_dist